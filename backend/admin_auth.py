@@ -3,57 +3,124 @@ Modulo de sessao administrativa com criptografia forte.
 
 Seguranca:
   - Chave derivada via HKDF-SHA256 (256-bit) a partir do SECRET_KEY
-  - Tokens de sessao: secrets.token_urlsafe(48) → 384 bits de entropia
-  - Tokens armazenados como hash SHA-256 (nunca em texto puro)
+  - Tokens de sessao: secrets.token_urlsafe(36) → 288 bits de entropia
+  - Tokens armazenados como metade de um HMAC-SHA256 (nunca em texto puro)
   - Payload da sessao criptografado com AES-256-GCM (nonce 96-bit unico)
-  - HMAC-SHA256 para verificacao de integridade do token
+  - HMAC-SHA256 para verificacao de integridade do token (mesmo digest,
+    outra metade — um unico hash por operacao)
   - Sessoes vinculadas a IP e com expiracao curta (configuravel)
+
+Desempenho:
+  - SHA-256/HMAC via hashlib/hmac (digestmod por nome → OpenSSL), que usa
+    SHA-NI automaticamente quando a CPU suporta. Requer Python linkado a
+    OpenSSL >= 1.1.1 (padrao nos builds oficiais e wheels manylinux).
 """
 
+import atexit
 import hashlib
-import json
+import hmac
 import os
+import queue
 import secrets
 import sqlite3
+import struct
 import threading
 import time
-from typing import List, Optional
-from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import List, Optional, Tuple
 from contextlib import contextmanager
-from datetime import datetime
 
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
-from cryptography.hazmat.primitives import hashes, hmac as crypto_hmac
+from cryptography.hazmat.primitives import hashes
 
 from backend.config import DB_PATH, SECRET_KEY, ADMIN_SESSION_EXPIRY_HOURS, log
 
+try:
+    # Opcional: base64 com kernels SIMD (mesma API do modulo base64)
+    from pybase64 import urlsafe_b64decode, urlsafe_b64encode
+except ImportError:
+    from base64 import urlsafe_b64decode, urlsafe_b64encode
+
 
 # ============================================================================
 # Derivacao de chaves (HKDF-SHA256, 256-bit)
 # ============================================================================
 
+# Salt determinístico derivado do SECRET_KEY (evita salt=None zero-length),
+# calculado uma unica vez no import
+_SECRET_KEY_BYTES = SECRET_KEY.encode('utf-8')
+_HKDF_SALT = hashlib.sha256(b'admin-hkdf-salt:' + _SECRET_KEY_BYTES).digest()
+
+
 def _derive_key(purpose: bytes) -> bytes:
     """
     Deriva uma chave de 256 bits a partir do SECRET_KEY usando HKDF-SHA256.
     Cada 'purpose' gera uma chave diferente (separacao de dominio).
     Salt derivado do SECRET_KEY para consistencia entre reinicializacoes.
     """
-    # Salt determinístico derivado do SECRET_KEY (evita salt=None zero-length)
-    salt = hashlib.sha256(b'admin-hkdf-salt:' + SECRET_KEY.encode('utf-8')).digest()
     hkdf = HKDF(
         algorithm=hashes.SHA256(),
         length=32,  # 256 bits
-        salt=salt,
+        salt=_HKDF_SALT,
         info=purpose,
     )
-    return hkdf.derive(SECRET_KEY.encode('utf-8'))
+    return hkdf.derive(_SECRET_KEY_BYTES)
 
 
 # Chaves derivadas para diferentes propositos (256-bit cada)
 _ENCRYPTION_KEY = _derive_key(b'admin-session-encryption-v1')
 _SIGNING_KEY = _derive_key(b'admin-session-signing-v1')
 
+# Algoritmo AES-256 unico (stateless, thread-safe); cada chamada so monta o modo GCM
+# com o nonce novo e usa o caminho EVP_aes_256_gcm do OpenSSL (AES-NI + PCLMUL).
+# Nao da para pre-montar o Cipher inteiro: modes.GCM amarra o nonce (e a tag)
+# no construtor, e reusar nonce com a mesma chave quebra o GCM.
+_AES = algorithms.AES(_ENCRYPTION_KEY)
+_GCM_TAG_SIZE = 16
+
+# Token de sessao: 36 bytes aleatorios → 48 caracteres base64url (288 bits)
+_TOKEN_BYTES = 36
+_TOKEN_LEN = 48
+
+
+# ============================================================================
+# Payload da sessao — layout binario fixo
+# ============================================================================
+
+# iat (double) | len(email) (uint16) | email | len(ip) (uint8) | ip | jti (16 bytes)
+_PAYLOAD_HEAD = struct.Struct('!dH')
+_PAYLOAD_IP_LEN = struct.Struct('!B')
+_JTI_SIZE = 16
+
+
+def _pack_session(data: dict) -> bytes:
+    """Serializa {email, ip, iat, jti} no layout binario (menor que JSON)."""
+    email = data['email'].encode('utf-8')
+    ip = data['ip'].encode('utf-8')
+    jti = bytes.fromhex(data['jti'])
+    if len(jti) != _JTI_SIZE:
+        raise ValueError('jti deve ter 128 bits')
+    return b''.join((
+        _PAYLOAD_HEAD.pack(data['iat'], len(email)), email,
+        _PAYLOAD_IP_LEN.pack(len(ip)), ip,
+        jti,
+    ))
+
+
+def _unpack_session(raw: bytes) -> dict:
+    """Inverso de _pack_session. Levanta ValueError/struct.error se malformado."""
+    iat, email_len = _PAYLOAD_HEAD.unpack_from(raw, 0)
+    pos = _PAYLOAD_HEAD.size
+    email = raw[pos:pos + email_len].decode('utf-8')
+    pos += email_len
+    (ip_len,) = _PAYLOAD_IP_LEN.unpack_from(raw, pos)
+    pos += _PAYLOAD_IP_LEN.size
+    ip = raw[pos:pos + ip_len].decode('utf-8')
+    pos += ip_len
+    if len(raw) - pos != _JTI_SIZE:
+        raise ValueError('payload de sessao malformado')
+    return {'email': email, 'ip': ip, 'iat': iat, 'jti': raw[pos:].hex()}
+
 
 # ============================================================================
 # Criptografia AES-256-GCM
@@ -61,15 +128,16 @@ _SIGNING_KEY = _derive_key(b'admin-session-signing-v1')
 
 def encrypt_payload(data: dict) -> str:
     """
-    Criptografa payload JSON com AES-256-GCM.
+    Criptografa payload da sessao ({email, ip, iat, jti}) com AES-256-GCM.
     Retorna string base64url: nonce(12) || ciphertext || tag(16)
     Chave: 256 bits (derivada via HKDF)
     """
-    plaintext = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    plaintext = _pack_session(data)
     nonce = os.urandom(12)  # 96-bit nonce (recomendado para GCM)
-    aesgcm = AESGCM(_ENCRYPTION_KEY)
-    ciphertext = aesgcm.encrypt(nonce, plaintext, None)
-    return urlsafe_b64encode(nonce + ciphertext).decode('ascii')
+    encryptor = Cipher(_AES, modes.GCM(nonce)).encryptor()
+    # Um unico buffer final (finalize() antes de .tag — ordem da tupla importa)
+    raw = b''.join((nonce, encryptor.update(plaintext), encryptor.finalize(), encryptor.tag))
+    return urlsafe_b64encode(raw).decode('ascii')
 
 
 def decrypt_payload(token: str) -> Optional[dict]:
@@ -78,131 +146,264 @@ def decrypt_payload(token: str) -> Optional[dict]:
     Retorna dict ou None se falhar (token adulterado/invalido).
     """
     try:
-        raw = urlsafe_b64decode(token)
+        raw = memoryview(urlsafe_b64decode(token))  # fatias sem copia
         nonce = raw[:12]
-        ciphertext = raw[12:]
-        aesgcm = AESGCM(_ENCRYPTION_KEY)
-        plaintext = aesgcm.decrypt(nonce, ciphertext, None)
-        return json.loads(plaintext)
+        ciphertext = raw[12:-_GCM_TAG_SIZE]
+        tag = bytes(raw[-_GCM_TAG_SIZE:])
+        decryptor = Cipher(_AES, modes.GCM(nonce, tag)).decryptor()
+        plaintext = decryptor.update(ciphertext) + decryptor.finalize()
+        return _unpack_session(plaintext)
     except Exception:
         return None
 
 
 # ============================================================================
-# HMAC-SHA256 para assinatura de tokens
+# HMAC-SHA256 — identificador de armazenamento + assinatura do token
 # ============================================================================
 
-def sign_token(token: str) -> str:
-    """Assina token com HMAC-SHA256 (256-bit key). Retorna hex."""
-    h = crypto_hmac.HMAC(_SIGNING_KEY, hashes.SHA256())
-    h.update(token.encode('utf-8'))
-    return h.finalize().hex()
+# HMAC pre-inicializado com a chave: ipad/opad calculados uma unica vez,
+# cada derivacao apenas copia o estado interno (.copy()) e processa o token
+_HMAC_TEMPLATE = hmac.new(_SIGNING_KEY, digestmod='sha256')
 
 
-def verify_signature(token: str, signature: str) -> bool:
-    """Verifica assinatura HMAC-SHA256."""
-    try:
-        h = crypto_hmac.HMAC(_SIGNING_KEY, hashes.SHA256())
-        h.update(token.encode('utf-8'))
-        h.verify(bytes.fromhex(signature))
-        return True
-    except Exception:
-        return False
+def _derive_token_ids(token: str) -> Tuple[str, str]:
+    """
+    Deriva (token_hash, signature) de um unico HMAC-SHA256 do token.
+    - token_hash: primeiros 128 bits (hex) — chave de armazenamento no banco
+    - signature:  ultimos 128 bits (hex) — enviada ao cliente junto do token
+    O banco nunca guarda a metade usada como assinatura (nem o token raw).
+    """
+    h = _HMAC_TEMPLATE.copy()
+    h.update(token.encode('utf-8'))
+    digest = h.digest()
+    return digest[:16].hex(), digest[16:].hex()
 
 
 # ============================================================================
-# Hash de token para armazenamento (SHA-256)
+# SQLite — tabelas admin
 # ============================================================================
 
-def _hash_token(token: str) -> str:
-    """SHA-256 do token para armazenamento seguro (nunca guardar raw)."""
-    return hashlib.sha256(token.encode('utf-8')).hexdigest()
-
+def _connect():
+    # Sem lock Python: WAL + busy timeout (5 s) do SQLite serializam escritores;
+    # BEGIN IMMEDIATE pega o lock de escrita ja no inicio da transacao.
+    # check_same_thread=False so e seguro porque _db_conn nunca entrega a mesma
+    # conexao a dois usuarios ao mesmo tempo. Nao aninhar `with _db_conn()` com
+    # escrita: a conexao interna esperaria o lock de escrita da externa
+    conn = sqlite3.connect(
+        DB_PATH, check_same_thread=False,
+        timeout=5.0, isolation_level='IMMEDIATE',
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-8000')       # ~8 MB de page cache
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA mmap_size=67108864')     # 64 MB mapeados
+    return conn
 
-# ============================================================================
-# SQLite — tabelas admin
-# ============================================================================
 
-_admin_lock = threading.Lock()
+# Pool de conexoes abertas (PRAGMAs uma vez por conexao), como auth._pooled.
+# Nao usa threading.local: sob o worker gevent ele vira greenlet-local e cada
+# request abriria (e perderia) uma conexao. Cada `with _db_conn()` retira uma
+# conexao so para si: duas greenlets nunca compartilham a mesma, e um uso
+# aninhado recebe outra conexao. Pool vazio abre outra; excedente e fechado
+_POOL_SIZE = 4
+_pool = queue.LifoQueue(maxsize=_POOL_SIZE)
 
 
 @contextmanager
 def _db_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
     try:
         yield conn
         conn.commit()
     except Exception:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            # Conexao quebrada: descartar em vez de devolver ao pool
+            conn.close()
+            conn = None
         raise
     finally:
-        conn.close()
+        if conn is not None:
+            try:
+                _pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+
+@atexit.register
+def _close_connections():
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+        except Exception:
+            pass
 
 
 def init_admin_db():
     """Cria tabelas de admin se nao existirem e migra coluna is_admin."""
-    with _admin_lock:
-        with _db_conn() as conn:
-            # Tabela de sessoes admin (server-side)
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS admin_sessions (
-                    token_hash   TEXT PRIMARY KEY,
-                    user_email   TEXT NOT NULL,
-                    ip_address   TEXT NOT NULL,
-                    encrypted_data TEXT NOT NULL,
-                    created_at   TEXT NOT NULL,
-                    expires_at   REAL NOT NULL,
-                    revoked      INTEGER DEFAULT 0
-                )
-            """)
-
-            # Adicionar coluna is_admin na tabela users (migration segura)
-            cols = [row['name'] for row in conn.execute("PRAGMA table_info(users)")]
-            if 'is_admin' not in cols:
-                conn.execute(
-                    "ALTER TABLE users ADD COLUMN is_admin INTEGER DEFAULT 0"
-                )
-                log.info('[ADMIN] Coluna is_admin adicionada a tabela users')
+    with _db_conn() as conn:
+        # Persistente no arquivo (auth.init_db ja aplica; aqui por garantia)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # created_at passou de TEXT (isoformat) para REAL (epoch, igual a
+        # expires_at). Sessoes sao descartaveis: recriar a tabela antiga
+        # so obriga os admins a logar de novo.
+        col_types = {
+            row['name']: row['type']
+            for row in conn.execute("PRAGMA table_info(admin_sessions)").fetchall()
+        }
+        if col_types.get('created_at', 'REAL') != 'REAL':
+            conn.execute("DROP TABLE admin_sessions")
+            log.info('[ADMIN] Tabela admin_sessions recriada (created_at REAL)')
+
+        # Tabela de sessoes admin (server-side)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS admin_sessions (
+                token_hash   TEXT PRIMARY KEY,
+                user_email   TEXT NOT NULL,
+                ip_address   TEXT NOT NULL,
+                encrypted_data TEXT NOT NULL,
+                created_at   REAL NOT NULL,
+                expires_at   REAL NOT NULL,
+                revoked      INTEGER DEFAULT 0
+            )
+        """)
+        # Indices para os writers (revogacao por usuario e limpeza por expiracao)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_admin_sessions_email "
+            "ON admin_sessions(user_email)"
+        )
+        # Indice parcial: so sessoes nao revogadas entram na busca por expiracao
+        conn.execute("DROP INDEX IF EXISTS idx_admin_sessions_expires")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_sessions_expiry "
+            "ON admin_sessions(expires_at) WHERE revoked = 0"
+        )
+
+        # Adicionar coluna is_admin na tabela users (migration segura)
+        cols = [row['name'] for row in conn.execute("PRAGMA table_info(users)")]
+        if 'is_admin' not in cols:
+            conn.execute(
+                "ALTER TABLE users ADD COLUMN is_admin INTEGER DEFAULT 0"
+            )
+            log.info('[ADMIN] Coluna is_admin adicionada a tabela users')
+        # Sessao admin vigente por usuario: revogacao/substituicao em O(1)
+        if 'active_session_hash' not in cols:
+            conn.execute(
+                "ALTER TABLE users ADD COLUMN active_session_hash TEXT"
+            )
+            log.info('[ADMIN] Coluna active_session_hash adicionada a tabela users')
 
     log.info('[ADMIN] Tabelas admin inicializadas')
+    _start_session_sweeper()
+
+
+# ============================================================================
+# Limpeza de sessoes em background
+# ============================================================================
+
+_SESSION_SWEEP_INTERVAL = 300  # 5 minutos
+_sweeper_started = False
+_sweeper_lock = threading.Lock()
+
+
+def _session_sweeper_loop():
+    """Thread daemon que remove sessoes expiradas/revogadas a cada 5 min."""
+    while True:
+        time.sleep(_SESSION_SWEEP_INTERVAL)
+        try:
+            cleanup_expired_sessions()
+        except Exception as e:
+            log.error(f'[ADMIN] Erro na limpeza de sessoes: {e}')
+
+
+def _start_session_sweeper():
+    """Inicia o sweeper uma unica vez por processo (init_admin_db e idempotente)."""
+    global _sweeper_started
+    with _sweeper_lock:
+        if _sweeper_started:
+            return
+        _sweeper_started = True
+    threading.Thread(
+        target=_session_sweeper_loop, daemon=True, name='admin-session-sweeper',
+    ).start()
 
 
 # ============================================================================
 # Gestao de admins
 # ============================================================================
 
+# Cache em processo de is_admin: {email: (is_admin, monotonic_ts)}
+# O conjunto de admins muda raramente e sempre via set_admin (que invalida).
+_is_admin_cache = {}
+_IS_ADMIN_TTL = 60  # segundos
+
+
 def set_admin(email: str, is_admin: bool = True):
     """Promove ou rebaixa usuario a admin."""
     email = email.strip().lower()
-    with _admin_lock:
-        with _db_conn() as conn:
-            conn.execute(
-                "UPDATE users SET is_admin = ? WHERE email = ?",
-                (1 if is_admin else 0, email),
-            )
+    with _db_conn() as conn:
+        conn.execute(
+            "UPDATE users SET is_admin = ? WHERE email = ?",
+            (1 if is_admin else 0, email),
+        )
+    _is_admin_cache.pop(email, None)
+    if not is_admin:
+        _forget_validated(email)
     action = 'promovido a admin' if is_admin else 'rebaixado de admin'
     log.info(f'[ADMIN] {email} {action}')
 
 
 def is_admin(email: str) -> bool:
-    """Verifica se usuario e admin."""
+    """Verifica se usuario e admin (cache com TTL de _IS_ADMIN_TTL segundos)."""
     email = email.strip().lower()
+    now = time.monotonic()
+    cached = _is_admin_cache.get(email)
+    if cached is not None and now - cached[1] < _IS_ADMIN_TTL:
+        return cached[0]
     with _db_conn() as conn:
         row = conn.execute(
             "SELECT is_admin FROM users WHERE email = ?",
             (email,),
         ).fetchone()
-        return bool(row and row['is_admin'])
+    result = bool(row and row['is_admin'])
+    _is_admin_cache[email] = (result, now)
+    return result
 
 
-def list_admins() -> List[dict]:
-    """Lista todos os admins."""
+def list_admins() -> List[sqlite3.Row]:
+    """Lista todos os admins (sqlite3.Row, serializadas direto pelo jsonify)."""
     with _db_conn() as conn:
-        rows = conn.execute(
+        return conn.execute(
             "SELECT id, email, created_at FROM users WHERE is_admin = 1"
         ).fetchall()
-        return [dict(r) for r in rows]
+
+
+# ============================================================================
+# Cache de sessoes validadas
+# ============================================================================
+
+# {sha256(token): (sessao, ip, monotonic_ts, expires_at)} — evita HMAC + SQLite
+# + AES-GCM para um admin que dispara varias requisicoes seguidas. Expiracao
+# vale na hora (expires_at conferido no hit); revoke_*/nova sessao invalidam.
+_validated_cache = {}
+_validated_lock = threading.Lock()
+_VALIDATED_TTL = 30  # segundos
+_VALIDATED_MAX = 1024
+
+
+def _forget_validated(email: str) -> None:
+    """Remove do cache todas as sessoes validadas de um usuario."""
+    with _validated_lock:
+        stale = [k for k, v in _validated_cache.items() if v[0]['email'] == email]
+        for k in stale:
+            del _validated_cache[k]
 
 
 # ============================================================================
@@ -214,58 +415,107 @@ def create_admin_session(email: str, ip: str) -> Optional[str]:
     Cria sessao admin segura. Retorna token_composto ou None se nao for admin.
 
     Token composto = token_raw + '.' + hmac_signature
-    - token_raw: secrets.token_urlsafe(48) → 384 bits de entropia
-    - Armazenado como SHA-256 hash no banco
+    - token_raw: secrets.token_urlsafe(36) → 288 bits de entropia
+    - Armazenado como metade do HMAC-SHA256 no banco (ver _derive_token_ids)
     - Dados da sessao criptografados com AES-256-GCM
     """
     if not is_admin(email):
         return None
 
-    token_raw = secrets.token_urlsafe(48)  # 384 bits
-    token_hash = _hash_token(token_raw)
-    signature = sign_token(token_raw)
+    token_raw = secrets.token_urlsafe(_TOKEN_BYTES)  # 288 bits
+    token_hash, signature = _derive_token_ids(token_raw)
 
     # Dados criptografados da sessao
+    now = time.time()
     session_data = {
         'email': email,
         'ip': ip,
-        'iat': time.time(),
+        'iat': now,
         'jti': secrets.token_hex(16),  # ID unico da sessao (128 bits)
     }
     encrypted = encrypt_payload(session_data)
 
-    now = datetime.now().isoformat()
-    expires_at = time.time() + (ADMIN_SESSION_EXPIRY_HOURS * 3600)
+    expires_at = now + (ADMIN_SESSION_EXPIRY_HOURS * 3600)
 
-    with _admin_lock:
-        with _db_conn() as conn:
-            # Revogar sessoes anteriores do mesmo usuario
-            conn.execute(
-                "UPDATE admin_sessions SET revoked = 1 WHERE user_email = ? AND revoked = 0",
-                (email,),
-            )
-            # Inserir nova sessao
-            conn.execute(
-                """INSERT INTO admin_sessions
-                   (token_hash, user_email, ip_address, encrypted_data, created_at, expires_at)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (token_hash, email, ip, encrypted, now, expires_at),
-            )
+    with _db_conn() as conn:
+        # Uma unica transacao (um commit no WAL) para substituir + inserir
+        # Substituir a sessao vigente do usuario (anteriores deixam de valer e
+        # saem do banco aqui mesmo, via idx_admin_sessions_email)
+        conn.execute(
+            "UPDATE users SET active_session_hash = ? WHERE email = ?",
+            (token_hash, email),
+        )
+        conn.execute("DELETE FROM admin_sessions WHERE user_email = ?", (email,))
+        # Inserir nova sessao
+        conn.execute(
+            """INSERT INTO admin_sessions
+               (token_hash, user_email, ip_address, encrypted_data, created_at, expires_at)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (token_hash, email, ip, encrypted, now, expires_at),
+        )
 
+    # Sessao anterior foi substituida: nao pode continuar valendo pelo cache
+    _forget_validated(email)
     log.info(f'[ADMIN] Sessao criada para {email} (IP: {ip}, expira em {ADMIN_SESSION_EXPIRY_HOURS}h)')
     return f'{token_raw}.{signature}'
 
 
+def _log_invalid_session(token_hash: str) -> None:
+    """Caminho frio: descobre por que a sessao foi rejeitada, so para o log."""
+    with _db_conn() as conn:
+        row = conn.execute(
+            """SELECT s.user_email, s.expires_at, s.revoked, u.active_session_hash
+               FROM admin_sessions s JOIN users u ON u.email = s.user_email
+               WHERE s.token_hash = ?""",
+            (token_hash,),
+        ).fetchone()
+
+    if not row:
+        log.warning('[ADMIN] Token nao encontrado no banco')
+    elif row['revoked'] or row['active_session_hash'] != token_hash:
+        log.warning(f'[ADMIN] Tentativa de usar sessao revogada: {row["user_email"]}')
+    else:
+        # Remocao fica com o sweeper em background (_session_sweeper_loop)
+        log.warning(f'[ADMIN] Sessao expirada: {row["user_email"]}')
+
+
 def validate_admin_session(token_composto: str, ip: str) -> Optional[dict]:
     """
-    Valida token de sessao admin.
+    Valida token de sessao admin, consultando antes o cache de sessoes
+    validadas (TTL de 30s, mesmo IP). Retorna dict da sessao ou None.
+    """
+    if not token_composto:
+        return None
+
+    key = hashlib.sha256(token_composto.encode('utf-8', 'replace')).digest()
+    cached = _validated_cache.get(key)
+    if (cached and cached[1] == ip and time.monotonic() - cached[2] < _VALIDATED_TTL
+            and time.time() < cached[3]):
+        return cached[0]
+
+    admin_session = _validate_admin_session(token_composto, ip)
+    if admin_session:
+        with _validated_lock:
+            _validated_cache.pop(key, None)
+            _validated_cache[key] = (
+                admin_session, ip, time.monotonic(), admin_session['expires_at'],
+            )
+            # FIFO: dict preserva ordem de insercao, descarta os mais antigos
+            while len(_validated_cache) > _VALIDATED_MAX:
+                del _validated_cache[next(iter(_validated_cache))]
+    return admin_session
+
+
+def _validate_admin_session(token_composto: str, ip: str) -> Optional[dict]:
+    """
+    Validacao completa (sem cache) do token de sessao admin.
     Retorna dict com dados da sessao ou None se invalido.
 
     Verificacoes:
     1. Formato do token (token.signature)
     2. HMAC-SHA256 do token
     3. Token hash existe no banco
-    4. Sessao nao revogada
+    4. Sessao nao revogada e ainda vigente para o usuario
     5. Sessao nao expirada
     6. IP confere
     7. Dados criptografados intactos
@@ -278,43 +528,33 @@ def validate_admin_session(token_composto: str, ip: str) -> Optional[dict]:
         return None
 
     token_raw, signature = parts
+    if len(token_raw) != _TOKEN_LEN:
+        return None
 
-    # 1. Verificar assinatura HMAC-SHA256
-    if not verify_signature(token_raw, signature):
+    # 1. Verificar assinatura HMAC-SHA256 (mesmo digest gera o token_hash)
+    token_hash, expected_signature = _derive_token_ids(token_raw)
+    if not hmac.compare_digest(expected_signature.encode('ascii'),
+                               signature.encode('utf-8', 'replace')):
         log.warning('[ADMIN] Token com assinatura HMAC invalida')
         return None
 
-    # 2. Buscar sessao no banco
-    token_hash = _hash_token(token_raw)
-
+    # 2. Buscar sessao valida no banco: revogacao, substituicao por login
+    #    mais recente e expiracao sao filtradas pelo proprio SQLite
     with _db_conn() as conn:
         row = conn.execute(
-            "SELECT * FROM admin_sessions WHERE token_hash = ?",
-            (token_hash,),
+            """SELECT s.user_email, s.ip_address, s.encrypted_data, s.created_at,
+                      s.expires_at
+               FROM admin_sessions s JOIN users u ON u.email = s.user_email
+               WHERE s.token_hash = ? AND s.revoked = 0 AND s.expires_at > ?
+                 AND u.active_session_hash = s.token_hash""",
+            (token_hash, time.time()),
         ).fetchone()
 
     if not row:
-        log.warning('[ADMIN] Token nao encontrado no banco')
-        return None
-
-    # 3. Sessao revogada?
-    if row['revoked']:
-        log.warning(f'[ADMIN] Tentativa de usar sessao revogada: {row["user_email"]}')
-        return None
-
-    # 4. Expirada?
-    if time.time() > row['expires_at']:
-        log.warning(f'[ADMIN] Sessao expirada: {row["user_email"]}')
-        # Revogar automaticamente
-        with _admin_lock:
-            with _db_conn() as conn:
-                conn.execute(
-                    "UPDATE admin_sessions SET revoked = 1 WHERE token_hash = ?",
-                    (token_hash,),
-                )
+        _log_invalid_session(token_hash)
         return None
 
-    # 5. IP confere?
+    # 3. IP confere?
     if row['ip_address'] != ip:
         log.warning(
             f'[ADMIN] IP divergente para {row["user_email"]}: '
@@ -322,7 +562,7 @@ def validate_admin_session(token_composto: str, ip: str) -> Optional[dict]:
         )
         return None
 
-    # 6. Descriptografar dados
+    # 4. Descriptografar dados
     decrypted = decrypt_payload(row['encrypted_data'])
     if not decrypted:
         log.error(f'[ADMIN] Falha ao descriptografar sessao: {row["user_email"]}')
@@ -332,6 +572,7 @@ def validate_admin_session(token_composto: str, ip: str) -> Optional[dict]:
         'email': row['user_email'],
         'ip': row['ip_address'],
         'created_at': row['created_at'],
+        'expires_at': row['expires_at'],
         'session_data': decrypted,
     }
 
@@ -342,14 +583,17 @@ def revoke_admin_session(token_composto: str):
         return False
 
     token_raw = token_composto.rsplit('.', 1)[0]
-    token_hash = _hash_token(token_raw)
+    token_hash, _ = _derive_token_ids(token_raw)
+    with _validated_lock:
+        _validated_cache.pop(
+            hashlib.sha256(token_composto.encode('utf-8', 'replace')).digest(), None,
+        )
 
-    with _admin_lock:
-        with _db_conn() as conn:
-            updated = conn.execute(
-                "UPDATE admin_sessions SET revoked = 1 WHERE token_hash = ?",
-                (token_hash,),
-            ).rowcount
+    with _db_conn() as conn:
+        updated = conn.execute(
+            "UPDATE admin_sessions SET revoked = 1 WHERE token_hash = ?",
+            (token_hash,),
+        ).rowcount
 
     if updated:
         log.info('[ADMIN] Sessao revogada')
@@ -357,46 +601,77 @@ def revoke_admin_session(token_composto: str):
 
 
 def revoke_all_admin_sessions(email: str):
-    """Revoga todas as sessoes de um admin."""
+    """
+    Revoga todas as sessoes de um admin (so a vigente pode estar valida) e
+    apaga as linhas dele. Retorna quantas sessoes ainda valiam.
+    """
     email = email.strip().lower()
-    with _admin_lock:
-        with _db_conn() as conn:
-            updated = conn.execute(
-                "UPDATE admin_sessions SET revoked = 1 WHERE user_email = ? AND revoked = 0",
-                (email,),
-            ).rowcount
-    log.info(f'[ADMIN] {updated} sessoes revogadas para {email}')
-    return updated
+    with _db_conn() as conn:
+        conn.execute(
+            """UPDATE users SET active_session_hash = NULL
+               WHERE email = ? AND active_session_hash IS NOT NULL""",
+            (email,),
+        )
+        purged = conn.execute(
+            """DELETE FROM admin_sessions WHERE user_email = ?
+               RETURNING revoked = 0 AND expires_at > ?""",
+            (email, time.time()),
+        ).fetchall()
+    revoked = sum(row[0] for row in purged)
+    # Usuario pode ter sido rebaixado/deletado: nao confiar no cache de is_admin
+    _is_admin_cache.pop(email, None)
+    _forget_validated(email)
+    log.info(f'[ADMIN] {revoked} sessoes revogadas para {email}')
+    return revoked
 
 
 def cleanup_expired_sessions():
-    """Remove sessoes expiradas ou revogadas do banco."""
-    with _admin_lock:
-        with _db_conn() as conn:
-            deleted = conn.execute(
-                "DELETE FROM admin_sessions WHERE revoked = 1 OR expires_at < ?",
-                (time.time(),),
-            ).rowcount
+    """
+    Remove sessoes expiradas ou revogadas do banco. Substituidas ja saem em
+    create_admin_session e revoke_all_admin_sessions.
+    """
+    with _db_conn() as conn:
+        # Comandos separados: com OR o SQLite varre a tabela inteira e
+        # ignora o indice parcial idx_sessions_expiry.
+        # RETURNING (SQLite >= 3.35) devolve o que foi apagado no mesmo comando
+        purged = conn.execute(
+            """DELETE FROM admin_sessions
+               WHERE revoked = 0 AND expires_at < ?
+               RETURNING user_email""",
+            (time.time(),),
+        ).fetchall()
+        purged += conn.execute(
+            "DELETE FROM admin_sessions WHERE revoked = 1 RETURNING user_email"
+        ).fetchall()
+    deleted = len(purged)
     if deleted:
-        log.info(f'[ADMIN] {deleted} sessoes expiradas removidas')
+        emails = sorted({row['user_email'] for row in purged})
+        log.info(f'[ADMIN] {deleted} sessoes expiradas removidas ({", ".join(emails)})')
     return deleted
 
 
-def list_active_sessions(email: str = None) -> List[dict]:
-    """Lista sessoes admin ativas (opcionalmente filtra por email)."""
+def list_active_sessions(email: str = None) -> List[sqlite3.Row]:
+    """
+    Lista sessoes admin ativas (opcionalmente filtra por email).
+    Retorna as sqlite3.Row como vieram; o jsonify do app serializa direto.
+    """
     with _db_conn() as conn:
         if email:
             rows = conn.execute(
-                """SELECT user_email, ip_address, created_at, expires_at
-                   FROM admin_sessions
-                   WHERE user_email = ? AND revoked = 0 AND expires_at > ?""",
+                """SELECT s.user_email, s.ip_address, s.expires_at,
+                          strftime('%Y-%m-%dT%H:%M:%S', s.created_at, 'unixepoch', 'localtime')
+                              AS created_at
+                   FROM users u JOIN admin_sessions s ON s.token_hash = u.active_session_hash
+                   WHERE u.email = ? AND s.revoked = 0 AND s.expires_at > ?""",
                 (email.strip().lower(), time.time()),
             ).fetchall()
         else:
             rows = conn.execute(
-                """SELECT user_email, ip_address, created_at, expires_at
-                   FROM admin_sessions
-                   WHERE revoked = 0 AND expires_at > ?""",
+                """SELECT s.user_email, s.ip_address, s.expires_at,
+                          strftime('%Y-%m-%dT%H:%M:%S', s.created_at, 'unixepoch', 'localtime')
+                              AS created_at
+                   FROM users u JOIN admin_sessions s ON s.token_hash = u.active_session_hash
+                   WHERE s.revoked = 0 AND s.expires_at > ?""",
                 (time.time(),),
             ).fetchall()
-    return [dict(r) for r in rows]
+    return rows
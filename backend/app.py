@@ -5,14 +5,22 @@ Monolito: serve API REST + WebSocket + frontend React (static).
 """
 
 import os
-import re
+import random
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
 import threading
 import time
 from datetime import timedelta
 from functools import wraps
-from flask import Flask, request, jsonify, send_from_directory, send_file, session
+from flask import (
+    Flask, Request, Response, g, request, jsonify, send_from_directory, send_file, session,
+)
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from flask_socketio import SocketIO, join_room
+from flask_socketio import SocketIO, emit, join_room
 
 from backend.config import (
     UPLOAD_FOLDER, JOBS_FOLDER, STATIC_FOLDER, MAX_CONTENT_LENGTH,
@@ -24,7 +32,8 @@ from backend.translator import (
 )
 from backend.auth import (
     init_db, get_or_create_user, list_all_users, get_system_stats, get_user_by_id,
-    generate_otp, verify_otp, send_otp_email,
+    get_user_by_email,
+    generate_otp, verify_otp, send_otp_email_async,
     register_user, login_user,
     clear_untranslated_cache,
     log_activity, get_user_activity, get_all_activity,
@@ -40,7 +49,14 @@ from backend.admin_auth import (
     is_admin, set_admin, list_admins, list_active_sessions,
     cleanup_expired_sessions,
 )
-from backend.config import ADMIN_EMAILS
+from backend.config import ADMIN_EMAILS, X_ACCEL_REDIRECT
+from backend import rate_limit
+
+try:
+    # Opcional: serializacao JSON mais rapida (ver _ORJSONProvider)
+    import orjson
+except ImportError:
+    orjson = None
 
 # ============================================================================
 # App
@@ -48,7 +64,78 @@ from backend.config import ADMIN_EMAILS
 
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-app = Flask(__name__, static_folder=STATIC_FOLDER, static_url_path='')
+
+class _UploadRequest(Request):
+    """
+    Request cujos arquivos multipart vao sempre para disco (UPLOAD_FOLDER),
+    sem o spool em memoria de ate 500 KB por arquivo do Werkzeug: o pico de
+    RSS do upload fica limitado ao buffer do parser.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        return tempfile.TemporaryFile(dir=UPLOAD_FOLDER)
+
+
+class _JSONProvider(DefaultJSONProvider):
+    """Serializa sqlite3.Row direto no jsonify (sem lista de dicts intermediaria)."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, sqlite3.Row):
+            return dict(o)
+        return DefaultJSONProvider.default(o)
+
+
+class _ORJSONProvider(_JSONProvider):
+    """
+    Mesmo provider, mas codificando com orjson (Rust): gera bytes direto,
+    sem o passo str -> UTF-8 do json da stdlib. Chaves nao ordenadas.
+    """
+
+    _OPTS = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._OPTS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(
+            obj, default=self.default, option=self._OPTS | orjson.OPT_APPEND_NEWLINE,
+        )
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+class _ORJSONPackets:
+    """
+    Serializador dos pacotes Socket.IO/Engine.IO (interface do modulo json):
+    cada emit de progresso codifica o to_dict() do job com orjson.
+    """
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        # separators do python-socketio ignorado: orjson ja e compacto
+        return orjson.dumps(
+            obj, default=_JSONProvider.default, option=_ORJSONProvider._OPTS,
+        ).decode('utf-8')
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
+
+# Atras do Nginx (X_ACCEL_REDIRECT) a rota de static embutida do Flask fica
+# desligada: serve_static responde so com X-Accel-Redirect
+app = Flask(
+    __name__,
+    static_folder=None if X_ACCEL_REDIRECT else STATIC_FOLDER,
+    static_url_path='',
+)
+app.json = _ORJSONProvider(app) if orjson else _JSONProvider(app)
+app.request_class = _UploadRequest
 
 # Confiar em 1 proxy (Nginx) para X-Forwarded-For e X-Forwarded-Proto
 # Garante que request.remote_addr reflita o IP real do cliente
@@ -81,7 +168,54 @@ try:
 except ImportError:
     _async_mode = 'threading'
 
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode=_async_mode)
+socketio = SocketIO(
+    app, cors_allowed_origins="*", async_mode=_async_mode,
+    json=_ORJSONPackets if orjson else None,
+)
+
+
+# ============================================================================
+# WebSocket — socket TCP de baixa latencia
+# ============================================================================
+
+_TCP_QUICKACK = getattr(socket, 'TCP_QUICKACK', None)  # so Linux
+
+
+def _raw_socket(environ):
+    """Socket TCP da conexao, conforme o servidor (gunicorn, gevent, werkzeug)."""
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is not None:
+        return sock
+    # gevent-websocket: WebSocket.stream.handler.socket
+    ws = environ.get('wsgi.websocket')
+    handler = getattr(getattr(ws, 'stream', None), 'handler', None)
+    if handler is not None:
+        return handler.socket
+    return getattr(environ.get('wsgi.input'), 'socket', None)
+
+
+def _low_latency_ws(wsgi_app):
+    """
+    Liga TCP_NODELAY (e TCP_QUICKACK no Linux) no socket de upgrade WebSocket:
+    frames de progresso sao pequenos e nao devem esperar o algoritmo de Nagle.
+    Feito no upgrade (e nao no evento connect) porque o Engine.IO conecta via
+    polling antes de trocar de transporte.
+    """
+    def middleware(environ, start_response):
+        if environ.get('HTTP_UPGRADE', '').lower() == 'websocket':
+            sock = _raw_socket(environ)
+            if sock is not None:
+                try:
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    if _TCP_QUICKACK is not None:
+                        sock.setsockopt(socket.IPPROTO_TCP, _TCP_QUICKACK, 1)
+                except (OSError, AttributeError) as e:
+                    log.debug(f'[WS] Nao foi possivel ajustar socket: {e}')
+        return wsgi_app(environ, start_response)
+    return middleware
+
+
+app.wsgi_app = _low_latency_ws(app.wsgi_app)
 
 # ============================================================================
 # Cleanup periodico (background thread)
@@ -104,7 +238,6 @@ def _cleanup_loop():
                 freed, _ = expire_job_files(expired_id)
                 total_freed += freed
                 total_jobs += 1
-            cleanup_expired_sessions()
             if total_jobs > 0:
                 log.info(f'[CLEANUP] {total_jobs} jobs expirados limpos, '
                          f'{total_freed / (1024*1024):.1f} MB liberados')
@@ -118,6 +251,44 @@ def _cleanup_loop():
 _cleanup_thread = threading.Thread(target=_cleanup_loop, daemon=True, name='cleanup')
 _cleanup_thread.start()
 
+# ============================================================================
+# Respostas JSON constantes
+# ============================================================================
+
+def _const_json(obj, status=200):
+    """
+    Fabrica de resposta JSON de payload fixo: serializa uma vez no boot e por
+    request so cria o Response. O objeto nunca e reaproveitado entre requests
+    (after_request, CORS e o cookie de sessao mutam os headers).
+    """
+    body = (app.json.dumps(obj) + '\n').encode('utf-8')
+
+    def make():
+        return app.response_class(body, status=status, mimetype='application/json')
+    return make
+
+
+def _json_body():
+    """
+    Corpo JSON (objeto) da request ou {}: le os bytes sem cachear e decodifica
+    com o provider do app (orjson quando instalado). Mantem a exigencia de
+    Content-Type JSON, que forca preflight CORS em POST cross-origin.
+    """
+    if not request.is_json:
+        return {}
+    try:
+        data = app.json.loads(request.get_data(cache=False))
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+_RESP_AUTH_REQUIRED = _const_json({'error': 'Autenticacao necessaria'}, 401)
+_RESP_HEALTH = _const_json({'status': 'ok', 'service': 'trans-script-web'})
+_RESP_LOGOUT = _const_json({'message': 'Logout realizado'})
+_RESP_JOB_REMOVED = _const_json({'message': 'Job removido'})
+_RESP_CANCEL_REQUESTED = _const_json({'message': 'Cancelamento solicitado'})
+
 # ============================================================================
 # Autenticacao
 # ============================================================================
@@ -127,7 +298,7 @@ def login_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         if 'user_email' not in session:
-            return jsonify({'error': 'Autenticacao necessaria'}), 401
+            return _RESP_AUTH_REQUIRED()
         return f(*args, **kwargs)
     return decorated
 
@@ -156,24 +327,28 @@ def admin_required(f):
     return decorated
 
 
-# Rate limit simples: {ip: timestamp_ultimo_upload}
-_upload_timestamps = {}
-
-# Rate limit para tentativas de admin login: {ip: [timestamp, ...]}
-_admin_login_attempts = {}
-_admin_login_lock = threading.Lock()
+# Rate limit para tentativas de admin login (token bucket por IP)
 _ADMIN_LOGIN_MAX_ATTEMPTS = 5
 _ADMIN_LOGIN_WINDOW = 300  # 5 minutos
 
-# Regex para validar job_id (apenas hex, 8 chars)
-_JOB_ID_RE = re.compile(r'^[a-f0-9]{8}$')
+# job_id valido: exatamente 8 chars hex minusculos (sem regex no caminho quente)
+_JOB_ID_LEN = 8
+_JOB_ID_CHARS = frozenset('0123456789abcdef')
+
+# Extensoes aceitas no upload, indexadas pelo tamanho do sufixo: so os
+# ultimos 8 chars do nome sao minusculizados, sem regex nem varrer tupla
+_ARCHIVE_TAILS = (
+    (4, frozenset(('.zip', '.rar', '.tar', '.tgz'))),
+    (5, frozenset(('.tbz2',))),
+    (7, frozenset(('.tar.gz',))),
+    (8, frozenset(('.tar.bz2',))),
+)
 
 
 # ============================================================================
 # Seguranca — headers em todas as respostas
 # ============================================================================
 
-@app.after_request
 def security_headers(response):
     response.headers['X-Content-Type-Options'] = 'nosniff'
     response.headers['X-Frame-Options'] = 'DENY'
@@ -182,6 +357,12 @@ def security_headers(response):
     return response
 
 
+# Atras do Nginx do deploy (X_ACCEL_REDIRECT) os headers sao adicionados pelo
+# proprio Nginx (add_header ... always), inclusive nos arquivos via X-Accel
+if not X_ACCEL_REDIRECT:
+    app.after_request(security_headers)
+
+
 # ============================================================================
 # Logging — toda requisicao
 # ============================================================================
@@ -196,30 +377,81 @@ def log_request():
 # Helpers
 # ============================================================================
 
+def _is_archive_name(filename):
+    tail = filename[-8:].lower()
+    return any(tail[-n:] in tails for n, tails in _ARCHIVE_TAILS)
+
+
+def _is_php_name(filename):
+    return filename[-4:].lower() == '.php'
+
+
 def _validate_job_id(job_id):
     """Valida formato do job_id para evitar path traversal."""
-    return bool(_JOB_ID_RE.match(job_id))
+    return (
+        isinstance(job_id, str)
+        and len(job_id) == _JOB_ID_LEN
+        and _JOB_ID_CHARS.issuperset(job_id)
+    )
 
 
 def _check_rate_limit(ip):
-    """Retorna True se o IP esta dentro do rate limit."""
-    now = time.time()
-    # Limpeza periodica: remove entradas com mais de 1h (evita crescimento indefinido)
-    if len(_upload_timestamps) > 1000:
-        stale = [k for k, v in _upload_timestamps.items() if now - v > 3600]
-        for k in stale:
-            del _upload_timestamps[k]
-    last = _upload_timestamps.get(ip, 0)
-    if now - last < RATE_LIMIT_SECONDS:
-        return False
-    _upload_timestamps[ip] = now
-    return True
+    """Retorna True se o IP esta dentro do rate limit (1 upload por janela)."""
+    return rate_limit.allow(f'upload:{ip}', 1, RATE_LIMIT_SECONDS)
+
+
+def _send_job_file(job_id, filename, mimetype, download_name):
+    """
+    Entrega arquivo de saida do job, ou None se o arquivo nao existe mais.
+    Atras do Nginx (X_ACCEL_REDIRECT) so devolve o header e o Nginx envia o
+    arquivo via sendfile(); auth e validacao do job_id continuam no Flask.
+    Um unico stat() por download (sem os.path.exists antes).
+    """
+    path = os.path.join(JOBS_FOLDER, job_id, filename)
+    try:
+        if X_ACCEL_REDIRECT:
+            os.stat(path)
+            return Response(headers={
+                'X-Accel-Redirect': f'/_protected/jobs/{job_id}/{filename}',
+                'Content-Type': mimetype,
+                'Content-Disposition': f'attachment; filename={download_name}',
+            })
+        # send_file faz o stat (tamanho/mtime para ETag, 304 e Range)
+        return send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+            conditional=True,
+        )
+    except FileNotFoundError:
+        return None
+
+
+def _request_memo(name, key, loader):
+    """Memoiza loader(key) no escopo da requisicao (flask.g)."""
+    memo = g.setdefault(name, {})
+    if key not in memo:
+        memo[key] = loader(key)
+    return memo[key]
+
+
+def _cached_get_job(job_id):
+    return _request_memo('_jobs', job_id, get_job)
+
+
+def _cached_get_job_db(job_id):
+    return _request_memo('_db_jobs', job_id, get_job_db)
+
+
+def _cached_get_user_by_id(user_id):
+    return _request_memo('_users_by_id', user_id, get_user_by_id)
 
 
 def _resolve_job(job_id, require_completed=False):
     """Resolve job da memoria ou DB. Retorna (dict, error_response).
     Se ok: (job_dict, None). Se erro: (None, response_tuple)."""
-    job = get_job(job_id)
+    job = _cached_get_job(job_id)
     if job:
         if job.user_email != session['user_email']:
             return None, (jsonify({'error': 'Acesso negado'}), 403)
@@ -227,7 +459,7 @@ def _resolve_job(job_id, require_completed=False):
             return None, (jsonify({'error': 'Traducao ainda nao concluida'}), 400)
         return job.to_dict(), None
 
-    db_job = get_job_db(job_id)
+    db_job = _cached_get_job_db(job_id)
     if not db_job:
         return None, (jsonify({'error': 'Job nao encontrado'}), 404)
     if db_job['user_email'] != session['user_email']:
@@ -237,6 +469,25 @@ def _resolve_job(job_id, require_completed=False):
     return db_job, None
 
 
+def job_required(require_completed=False):
+    """
+    Decorator para rotas /api/jobs/<job_id>: valida o job_id, resolve o job
+    (memoria ou DB) uma unica vez, confere dono e estado e injeta `job`
+    (dict) na view. Usar abaixo de @login_required.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(job_id, *args, **kwargs):
+            if not _validate_job_id(job_id):
+                return jsonify({'error': 'ID invalido'}), 400
+            job, err = _resolve_job(job_id, require_completed)
+            if err:
+                return err
+            return f(job_id, job, *args, **kwargs)
+        return decorated
+    return decorator
+
+
 # ============================================================================
 # Rotas de autenticacao
 # ============================================================================
@@ -244,7 +495,7 @@ def _resolve_job(job_id, require_completed=False):
 @app.route('/api/auth/register', methods=['POST'])
 def auth_register():
     """Cadastro com e-mail + senha."""
-    data = request.get_json(silent=True) or {}
+    data = _json_body()
     email = (data.get('email') or '').strip().lower()
     password = data.get('password') or ''
 
@@ -263,7 +514,7 @@ def auth_register():
 @app.route('/api/auth/login', methods=['POST'])
 def auth_login():
     """Login com e-mail + senha."""
-    data = request.get_json(silent=True) or {}
+    data = _json_body()
     email = (data.get('email') or '').strip().lower()
     password = data.get('password') or ''
 
@@ -286,17 +537,14 @@ def auth_login():
 @app.route('/api/auth/request-otp', methods=['POST'])
 def auth_request_otp():
     """Solicita OTP — apenas para contas existentes (recuperacao de senha)."""
-    data = request.get_json(silent=True) or {}
+    data = _json_body()
     email = (data.get('email') or '').strip().lower()
 
     if not email or '@' not in email or '.' not in email.split('@')[-1]:
         return jsonify({'error': 'E-mail invalido'}), 400
 
     # Verificar se a conta existe — mensagem generica para evitar enumeracao
-    from backend.auth import _db_conn
-    with _db_conn() as conn:
-        row = conn.execute("SELECT id FROM users WHERE email = ?", (email,)).fetchone()
-    if not row:
+    if not get_user_by_email(email):
         # Nao revelar se o e-mail existe ou nao
         return jsonify({'message': 'Se o e-mail estiver cadastrado, voce recebera um codigo.'}), 200
 
@@ -304,10 +552,8 @@ def auth_request_otp():
     if code is None:
         return jsonify({'error': f'Aguarde {remaining}s para solicitar um novo codigo'}), 429
 
-    try:
-        send_otp_email(email, code)
-    except RuntimeError as e:
-        return jsonify({'error': 'Erro ao enviar e-mail. Tente novamente.'}), 500
+    # Envio SMTP em background: a resposta nao espera o handshake
+    send_otp_email_async(email, code)
 
     log.info(f'[AUTH] OTP recuperacao solicitado: {email}')
     return jsonify({'message': 'Se o e-mail estiver cadastrado, voce recebera um codigo.'}), 200
@@ -316,7 +562,7 @@ def auth_request_otp():
 @app.route('/api/auth/verify-otp', methods=['POST'])
 def auth_verify_otp():
     """Verifica OTP — apenas para contas existentes (recuperacao de senha)."""
-    data = request.get_json(silent=True) or {}
+    data = _json_body()
     email = (data.get('email') or '').strip().lower()
     code = (data.get('code') or '').strip()
 
@@ -328,15 +574,10 @@ def auth_verify_otp():
         return jsonify({'error': reason}), 401
 
     # Apenas login — nao cria conta nova
-    from backend.auth import _db_conn
-    with _db_conn() as conn:
-        row = conn.execute(
-            "SELECT id, email, created_at FROM users WHERE email = ?", (email,)
-        ).fetchone()
-    if not row:
+    user = get_user_by_email(email)
+    if not user:
         return jsonify({'error': 'Conta nao encontrada. Cadastre-se primeiro.'}), 401
 
-    user = dict(row)
     user['is_admin'] = is_admin(email)
     session['user_email'] = email
     session.permanent = True
@@ -354,7 +595,7 @@ def auth_logout():
             revoke_all_admin_sessions(email)
         log.info(f'[AUTH] Logout: {email}')
     session.clear()
-    return jsonify({'message': 'Logout realizado'}), 200
+    return _RESP_LOGOUT()
 
 
 @app.route('/api/auth/me')
@@ -362,8 +603,10 @@ def auth_me():
     email = session.get('user_email')
     if not email:
         return jsonify({'error': 'Nao autenticado'}), 401
-    user = get_or_create_user(email)
-    user['is_admin'] = is_admin(email)
+    # Caminho quente (SPA chama no load): um SELECT com is_admin, sem a
+    # transacao de escrita do get_or_create_user
+    user = get_user_by_email(email) or get_or_create_user(email)
+    user['is_admin'] = bool(user.get('is_admin'))
     user['quota'] = get_user_quota(email)
     return jsonify({'user': user}), 200
 
@@ -374,7 +617,49 @@ def auth_me():
 
 @app.route('/api/health')
 def health():
-    return jsonify({'status': 'ok', 'service': 'trans-script-web'})
+    return _RESP_HEALTH()
+
+
+_UPLOAD_CHUNK = 1 << 20  # 1 MiB por leitura/escrita ao gravar uploads
+_HAS_SENDFILE = sys.platform.startswith('linux') and hasattr(os, 'sendfile')
+_HAS_FADVISE = hasattr(os, 'posix_fadvise')
+
+
+def _upload_suffix():
+    """
+    Sufixo de 64 bits para nomes temporarios em UPLOAD_FOLDER. So precisa ser
+    unico, nao imprevisivel: PRNG do modulo random (semeado do SO no import e
+    re-semeado a cada fork), sem syscall getrandom por upload.
+    """
+    return f'{random.getrandbits(64):016x}'
+
+
+def _save_upload(f, dest):
+    """
+    Grava um arquivo do multipart em `dest` e retorna os bytes gravados.
+    No Linux, como as partes ja estao em TemporaryFile (_UploadRequest),
+    copia fd->fd com sendfile() sem passar os dados pelo Python.
+    """
+    with open(dest, 'wb') as out:
+        if _HAS_SENDFILE:
+            try:
+                in_fd = f.stream.fileno()
+            except (AttributeError, OSError):
+                in_fd = None
+            if in_fd is not None:
+                size = os.fstat(in_fd).st_size
+                if _HAS_FADVISE:
+                    # Leitura sequencial do temp: readahead mais agressivo
+                    os.posix_fadvise(in_fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                offset = 0
+                while offset < size:
+                    sent = os.sendfile(out.fileno(), in_fd, offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return offset
+        shutil.copyfileobj(f.stream, out, _UPLOAD_CHUNK)
+        return out.tell()
 
 
 @app.route('/api/upload', methods=['POST'])
@@ -394,45 +679,53 @@ def upload_file():
         log.warning(f'{ip} bloqueado: {running} jobs rodando (max {MAX_CONCURRENT_JOBS})')
         return jsonify({'error': f'Limite de {MAX_CONCURRENT_JOBS} traducoes simultaneas'}), 429
 
-    delay = max(0.05, min(float(request.form.get('delay', 0.2)), 5.0))
+    # Arquivo compactado pode vir como corpo bruto (application/octet-stream,
+    # nome e delay na query string): gravado em streaming, sem parser multipart
+    raw_upload = request.mimetype == 'application/octet-stream'
+    params = request.args if raw_upload else request.form
+    delay = max(0.05, min(float(params.get('delay', 0.2)), 5.0))
 
     # ── Modo 2: multiplos arquivos PHP avulsos ──────────────────────────────
     raw_files = request.files.getlist('files')
     if raw_files:
         paths = request.form.getlist('paths')
+        n_paths = len(paths)
 
-        # Validar: todos devem ser .php
-        for i, f in enumerate(raw_files):
-            if not f.filename or not f.filename.lower().endswith('.php'):
-                log.warning(f'{ip} arquivo PHP rejeitado: {f.filename}')
-                return jsonify({'error': f'Arquivo nao e .php: {f.filename}'}), 400
-
-        # Salvar arquivos em diretorio temporario preservando caminhos relativos
-        tmp_dir = os.path.join(UPLOAD_FOLDER, f"raw_{os.urandom(8).hex()}")
+        # Validar (todos devem ser .php) e salvar numa unica passada, em
+        # diretorio temporario preservando caminhos relativos
+        tmp_dir = os.path.join(UPLOAD_FOLDER, f"raw_{_upload_suffix()}")
+        tmp_dir_prefix = tmp_dir + os.sep
+        created_dirs = set()  # makedirs uma vez por diretorio, nao por arquivo
         total_size = 0
 
         try:
             for i, f in enumerate(raw_files):
+                if not f.filename or not _is_php_name(f.filename):
+                    log.warning(f'{ip} arquivo PHP rejeitado: {f.filename}')
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    return jsonify({'error': f'Arquivo nao e .php: {f.filename}'}), 400
+
                 # Usar caminho relativo se fornecido, senao nome do arquivo
-                rel_path = paths[i] if i < len(paths) else f.filename
+                rel_path = paths[i] if i < n_paths else f.filename
                 # Sanitizar: remover prefixo de pasta raiz do webkitdirectory
                 # (ex: "minha_pasta/sub/file.php" -> "sub/file.php" ou "file.php")
-                parts = rel_path.replace('\\', '/').split('/')
-                if len(parts) > 1:
-                    # Remover primeiro nivel (nome da pasta selecionada)
-                    rel_path = '/'.join(parts[1:])
-                else:
-                    rel_path = parts[0]
-
-                # Prevenir path traversal
-                safe_path = os.path.normpath(rel_path)
-                if safe_path.startswith('..') or os.path.isabs(safe_path):
+                head, sep, tail = rel_path.replace('\\', '/').partition('/')
+                # Remover primeiro nivel (nome da pasta selecionada)
+                rel_path = tail if sep else head
+
+                # Prevenir path traversal: checagem por componente (sem normpath);
+                # '/' inicial, '//' e '.' so somem, '..' rejeita
+                parts = [p for p in rel_path.split('/') if p and p != '.']
+                if not parts or '..' in parts:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
                     return jsonify({'error': f'Caminho invalido: {rel_path}'}), 400
 
-                dest = os.path.join(tmp_dir, safe_path)
-                os.makedirs(os.path.dirname(dest), exist_ok=True)
-                f.save(dest)
-                total_size += os.path.getsize(dest)
+                dest = tmp_dir_prefix + os.sep.join(parts)
+                parent = os.path.dirname(dest)
+                if parent not in created_dirs:
+                    os.makedirs(parent, exist_ok=True)
+                    created_dirs.add(parent)
+                total_size += _save_upload(f, dest)  # bytes gravados, sem stat() extra
 
             log.info(f'{ip} upload: {len(raw_files)} arquivos PHP ({total_size / 1024:.1f} KB)')
 
@@ -444,31 +737,38 @@ def upload_file():
         except Exception as e:
             log.error(f'{ip} erro ao criar job (PHP avulsos): {e}')
             if os.path.exists(tmp_dir):
-                import shutil
                 shutil.rmtree(tmp_dir, ignore_errors=True)
             return jsonify({'error': 'Erro interno ao processar arquivos'}), 500
 
     # ── Modo 1: arquivo compactado (ZIP, RAR, TAR) ─────────────────────────
-    if 'file' not in request.files:
+    if raw_upload:
+        f = None
+        original_name = request.args.get('filename', '')
+    elif 'file' in request.files:
+        f = request.files['file']
+        original_name = f.filename
+    else:
         return jsonify({'error': 'Nenhum arquivo enviado'}), 400
 
-    f = request.files['file']
-    allowed = ('.zip', '.rar', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2')
-    if not f.filename or not f.filename.lower().endswith(allowed):
-        log.warning(f'{ip} arquivo rejeitado: {f.filename}')
+    if not original_name or not _is_archive_name(original_name):
+        log.warning(f'{ip} arquivo rejeitado: {original_name}')
         return jsonify({'error': 'Formatos aceitos: ZIP, RAR, TAR, TAR.GZ ou arquivos .php'}), 400
 
-    ext = '.' + f.filename.rsplit('.', 1)[-1]
-    filename = f"upload_{os.urandom(8).hex()}{ext}"
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
-    f.save(filepath)
+    # O arquivo nao e copiado para um caminho proprio: a extracao le direto
+    # do TemporaryFile do upload (anonimo, some ao ser fechado)
+    if raw_upload:
+        archive = tempfile.TemporaryFile(dir=UPLOAD_FOLDER)
+        shutil.copyfileobj(request.stream, archive, _UPLOAD_CHUNK)
+    else:
+        archive = f.stream
+        archive.seek(0, os.SEEK_END)
+    file_size = archive.tell()
 
-    file_size = os.path.getsize(filepath)
-    log.info(f'{ip} upload: {f.filename} ({file_size / 1024:.1f} KB)')
+    log.info(f'{ip} upload: {original_name} ({file_size / 1024:.1f} KB)')
 
     # Verificar quota de storage
     if not check_storage_available(session['user_email'], file_size):
-        os.remove(filepath)
+        archive.close()
         quota = get_user_quota(session['user_email'])
         deletable = get_user_deletable_jobs(session['user_email'], limit=5)
         log.warning(f'{ip} quota excedida: {quota["used_mb"]} MB / {quota["limit_mb"]} MB')
@@ -481,16 +781,16 @@ def upload_file():
 
 
     try:
-        job_id = start_translation(filepath, delay, socketio, user_email=session['user_email'])
-        os.remove(filepath)
+        job_id = start_translation(archive, delay, socketio,
+                                   user_email=session['user_email'], archive_name=original_name)
         log_activity(session['user_email'], 'upload', f'Arquivo compactado, job {job_id}', ip)
         log.info(f'{ip} job criado: {job_id} (delay={delay}s)')
         return jsonify({'job_id': job_id}), 201
     except Exception as e:
         log.error(f'{ip} erro ao criar job: {e}')
-        if os.path.exists(filepath):
-            os.remove(filepath)
         return jsonify({'error': 'Erro interno ao processar arquivo'}), 500
+    finally:
+        archive.close()
 
 
 @app.route('/api/jobs')
@@ -501,87 +801,63 @@ def get_jobs():
 
 @app.route('/api/jobs/<job_id>')
 @login_required
-def get_job_status(job_id):
-    if not _validate_job_id(job_id):
-        return jsonify({'error': 'ID invalido'}), 400
-    data, err = _resolve_job(job_id)
-    if err:
-        return err
-    return jsonify(data)
+@job_required()
+def get_job_status(job_id, job):
+    # Job vivo: JSON em cache no proprio job (polling nao re-serializa)
+    live_job = _cached_get_job(job_id)
+    if live_job:
+        return app.response_class(live_job.to_json(), mimetype='application/json')
+    return jsonify(job)
 
 
 @app.route('/api/jobs/<job_id>/download')
 @login_required
-def download_job(job_id):
-    if not _validate_job_id(job_id):
-        return jsonify({'error': 'ID invalido'}), 400
-    data, err = _resolve_job(job_id, require_completed=True)
-    if err:
-        return err
-    zip_path = os.path.join(JOBS_FOLDER, job_id, 'output.zip')
-    if not os.path.exists(zip_path):
+@job_required(require_completed=True)
+def download_job(job_id, job):
+    resp = _send_job_file(job_id, 'output.zip', 'application/zip', f'traducao_{job_id}.zip')
+    if resp is None:
         return jsonify({'error': 'Arquivo de saida nao encontrado (pode ter sido limpo)'}), 410
     log_activity(session['user_email'], 'download', f'Job {job_id}', request.remote_addr)
     log.info(f'{request.remote_addr} download ZIP: {job_id}')
-    return send_file(
-        zip_path,
-        mimetype='application/zip',
-        as_attachment=True,
-        download_name=f'traducao_{job_id}.zip',
-    )
+    return resp
 
 
 @app.route('/api/jobs/<job_id>/download/voipnow')
 @login_required
-def download_voipnow(job_id):
+@job_required(require_completed=True)
+def download_voipnow(job_id, job):
     """Download do language pack no formato VoipNow (tar.gz)."""
-    if not _validate_job_id(job_id):
-        return jsonify({'error': 'ID invalido'}), 400
-    data, err = _resolve_job(job_id, require_completed=True)
-    if err:
-        return err
-    tar_path = os.path.join(JOBS_FOLDER, job_id, 'voipnow.tar.gz')
-    if not os.path.exists(tar_path):
+    resp = _send_job_file(
+        job_id, 'voipnow.tar.gz', 'application/gzip', f'voipnow_pt_br_{job_id}.tar.gz',
+    )
+    if resp is None:
         return jsonify({'error': 'Arquivo VoipNow nao encontrado'}), 410
     log.info(f'{request.remote_addr} download VoipNow: {job_id}')
-    return send_file(
-        tar_path,
-        mimetype='application/gzip',
-        as_attachment=True,
-        download_name=f'voipnow_pt_br_{job_id}.tar.gz',
-    )
+    return resp
 
 
 @app.route('/api/jobs/<job_id>', methods=['DELETE'])
 @login_required
-def remove_job(job_id):
-    if not _validate_job_id(job_id):
-        return jsonify({'error': 'ID invalido'}), 400
-    data, err = _resolve_job(job_id)
-    if err:
-        return err
+@job_required()
+def remove_job(job_id, job):
     delete_job(job_id)
     log_activity(session['user_email'], 'delete_job', f'Job {job_id}', request.remote_addr)
     log.info(f'{request.remote_addr} deletou job: {job_id}')
-    return jsonify({'message': 'Job removido'})
+    return _RESP_JOB_REMOVED()
 
 
 @app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
 @login_required
-def cancel_job(job_id):
-    if not _validate_job_id(job_id):
-        return jsonify({'error': 'ID invalido'}), 400
-    job = get_job(job_id)
-    if not job:
-        return jsonify({'error': 'Job nao encontrado'}), 404
-    if job.user_email != session['user_email']:
-        return jsonify({'error': 'Acesso negado'}), 403
-    if job.status != 'running':
+@job_required()
+def cancel_job(job_id, job):
+    # So jobs vivos em memoria podem ser cancelados
+    live_job = _cached_get_job(job_id)
+    if not live_job or live_job.status != 'running':
         return jsonify({'error': 'Job nao esta em execucao'}), 400
-    job.cancel()
+    live_job.cancel()
     log_activity(session['user_email'], 'cancel_job', f'Job {job_id}', request.remote_addr)
     log.info(f'{request.remote_addr} cancelou job: {job_id}')
-    return jsonify({'message': 'Cancelamento solicitado'})
+    return _RESP_CANCEL_REQUESTED()
 
 
 # ============================================================================
@@ -618,23 +894,19 @@ def admin_login():
     """
     ip = request.remote_addr
 
-    # Rate limit de tentativas de admin login por IP (thread-safe)
-    now = time.time()
-    with _admin_login_lock:
-        attempts = _admin_login_attempts.get(ip, [])
-        attempts = [t for t in attempts if now - t < _ADMIN_LOGIN_WINDOW]
-        if len(attempts) >= _ADMIN_LOGIN_MAX_ATTEMPTS:
-            log.warning(f'[ADMIN] Rate limit atingido para IP {ip}')
-            return jsonify({'error': 'Muitas tentativas. Aguarde 5 minutos.'}), 429
+    # Rate limit de tentativas de admin login por IP
+    attempts_key = f'admin_login:{ip}'
+    wait = rate_limit.retry_after(attempts_key, _ADMIN_LOGIN_MAX_ATTEMPTS, _ADMIN_LOGIN_WINDOW)
+    if wait:
+        log.warning(f'[ADMIN] Rate limit atingido para IP {ip}')
+        resp = jsonify({'error': f'Muitas tentativas. Aguarde {wait}s.', 'retry_after': wait})
+        resp.headers['Retry-After'] = str(wait)
+        return resp, 429
 
     email = session['user_email']
 
     if not is_admin(email):
-        with _admin_login_lock:
-            attempts = _admin_login_attempts.get(ip, [])
-            attempts = [t for t in attempts if now - t < _ADMIN_LOGIN_WINDOW]
-            attempts.append(now)
-            _admin_login_attempts[ip] = attempts
+        rate_limit.record(attempts_key, _ADMIN_LOGIN_MAX_ATTEMPTS, _ADMIN_LOGIN_WINDOW)
         log.warning(f'[ADMIN] Tentativa de login admin negada: {email} ({ip})')
         return jsonify({'error': 'Acesso negado'}), 403
 
@@ -643,8 +915,7 @@ def admin_login():
         return jsonify({'error': 'Erro ao criar sessao admin'}), 500
 
     # Limpar tentativas em caso de sucesso
-    with _admin_login_lock:
-        _admin_login_attempts.pop(ip, None)
+    rate_limit.reset(attempts_key)
 
     return jsonify({
         'token': token,
@@ -670,7 +941,9 @@ def admin_me():
         'email': request.admin_email,
         'is_admin': True,
         'session': {
-            'created_at': request.admin_session['created_at'],
+            'created_at': time.strftime(
+                '%Y-%m-%dT%H:%M:%S', time.localtime(request.admin_session['created_at']),
+            ),
             'ip': request.admin_session['ip'],
         },
     })
@@ -691,7 +964,7 @@ def admin_list_users():
 @admin_required
 def admin_toggle_user(user_id):
     """Promove ou rebaixa usuario a admin."""
-    row = get_user_by_id(user_id)
+    row = _cached_get_user_by_id(user_id)
     if not row:
         return jsonify({'error': 'Usuario nao encontrado'}), 404
 
@@ -731,7 +1004,7 @@ def admin_list_sessions():
 @admin_required
 def admin_revoke_all():
     """Revoga todas as sessoes de um admin (exceto a propria)."""
-    data = request.get_json(silent=True) or {}
+    data = _json_body()
     target_email = data.get('email', '').strip().lower()
     if not target_email:
         return jsonify({'error': 'E-mail obrigatorio'}), 400
@@ -780,7 +1053,7 @@ def admin_activity():
 @admin_required
 def admin_user_activity(user_id):
     """Log de atividades de um usuario especifico."""
-    row = get_user_by_id(user_id)
+    row = _cached_get_user_by_id(user_id)
     if not row:
         return jsonify({'error': 'Usuario nao encontrado'}), 404
     limit = min(int(request.args.get('limit', 50)), 200)
@@ -791,7 +1064,7 @@ def admin_user_activity(user_id):
 @admin_required
 def admin_user_history(user_id):
     """Historico de jobs de um usuario especifico."""
-    row = get_user_by_id(user_id)
+    row = _cached_get_user_by_id(user_id)
     if not row:
         return jsonify({'error': 'Usuario nao encontrado'}), 404
     return jsonify(get_user_job_history(row['email']))
@@ -801,7 +1074,7 @@ def admin_user_history(user_id):
 @admin_required
 def admin_delete_user(user_id):
     """Deleta conta de usuario."""
-    row = get_user_by_id(user_id)
+    row = _cached_get_user_by_id(user_id)
     if not row:
         return jsonify({'error': 'Usuario nao encontrado'}), 404
     if row['is_admin']:
@@ -827,7 +1100,7 @@ def admin_all_job_history():
 @admin_required
 def admin_reconcile_storage():
     """Recalcula storage_used_bytes de todos os usuarios a partir do disco."""
-    from backend.auth import update_storage_used, _db_conn, _db_lock
+    from backend.auth import update_storage_used, _db_conn, _read_conn
     from backend.translator import _get_dir_size
     users = list_all_users()
     users_fixed = 0
@@ -836,7 +1109,7 @@ def admin_reconcile_storage():
     for user in users:
         email = user['email']
         real_bytes = 0
-        with _db_conn() as conn:
+        with _read_conn() as conn:
             rows = conn.execute(
                 "SELECT job_id FROM job_history WHERE user_email = ? AND file_available = 1",
                 (email,),
@@ -851,12 +1124,11 @@ def admin_reconcile_storage():
         delta = real_bytes - db_bytes
 
         if abs(delta) > 1024:
-            with _db_lock:
-                with _db_conn() as conn:
-                    conn.execute(
-                        "UPDATE users SET storage_used_bytes = ? WHERE email = ?",
-                        (real_bytes, email),
-                    )
+            with _db_conn() as conn:
+                conn.execute(
+                    "UPDATE users SET storage_used_bytes = ? WHERE email = ?",
+                    (real_bytes, email),
+                )
             log.info(f'[RECONCILE] {email}: DB={db_bytes/(1024*1024):.1f}MB, '
                      f'disk={real_bytes/(1024*1024):.1f}MB, delta={delta/(1024*1024):.1f}MB')
             users_fixed += 1
@@ -1002,18 +1274,48 @@ def ws_join_job(data):
         return
     join_room(job_id)
     log.debug(f'WS join_job: {job_id} ({request.remote_addr})')
-    socketio.emit('translation_progress', job.to_dict(), room=job_id)
+    # Estado completo so para quem entrou (aba nova, reconexao, job ja
+    # concluido): o flush coalescido manda to_progress_dict(), sem errors/validation
+    emit('translation_progress', job.to_dict(), to=request.sid)
 
 
 # ============================================================================
 # Frontend SPA (React build)
 # ============================================================================
 
+def _scan_static_files():
+    """Caminhos relativos (com '/') de todos os arquivos do build do frontend."""
+    if not os.path.isdir(STATIC_FOLDER):
+        return frozenset()
+    return frozenset(
+        os.path.relpath(os.path.join(root, name), STATIC_FOLDER).replace(os.sep, '/')
+        for root, _, names in os.walk(STATIC_FOLDER)
+        for name in names
+    )
+
+
+# Build do frontend so muda em deploy: lista carregada uma vez no boot, lookup
+# O(1) por request em vez de stat(). Recarregar via /api/admin/static/reload
+_STATIC_FILES = _scan_static_files()
+
+
+def _send_static(path):
+    """
+    Entrega arquivo do build. Atras do Nginx (X_ACCEL_REDIRECT) so devolve o
+    header e o Nginx envia o arquivo via sendfile(), sem ocupar o worker.
+    Sem Content-Type: o Nginx deduz pela extensao.
+    """
+    if X_ACCEL_REDIRECT:
+        resp = Response(headers={'X-Accel-Redirect': f'/_internal_static/{path}'})
+        del resp.headers['Content-Type']
+        return resp
+    return send_from_directory(STATIC_FOLDER, path)
+
+
 @app.route('/')
 def serve_index():
-    index = os.path.join(STATIC_FOLDER, 'index.html')
-    if os.path.exists(index):
-        return send_from_directory(STATIC_FOLDER, 'index.html')
+    if 'index.html' in _STATIC_FILES:
+        return _send_static('index.html')
     return (
         '<html><body style="font-family:sans-serif;padding:40px;text-align:center">'
         '<h1>Traducao</h1>'
@@ -1024,15 +1326,24 @@ def serve_index():
 
 @app.route('/<path:path>')
 def serve_static(path):
-    full = os.path.join(STATIC_FOLDER, path)
-    if os.path.exists(full):
-        return send_from_directory(STATIC_FOLDER, path)
-    index = os.path.join(STATIC_FOLDER, 'index.html')
-    if os.path.exists(index):
-        return send_from_directory(STATIC_FOLDER, 'index.html')
+    # So caminhos do build: '..' e absolutos nunca estao no conjunto
+    if path in _STATIC_FILES:
+        return _send_static(path)
+    if 'index.html' in _STATIC_FILES:
+        return _send_static('index.html')
     return jsonify({'error': 'Not found'}), 404
 
 
+@app.route('/api/admin/static/reload', methods=['POST'])
+@admin_required
+def admin_reload_static():
+    """Relista o build do frontend (apos deploy sem reiniciar o servico)."""
+    global _STATIC_FILES
+    _STATIC_FILES = _scan_static_files()
+    log.info(f'[STATIC] Build recarregado: {len(_STATIC_FILES)} arquivos')
+    return jsonify({'files': len(_STATIC_FILES)})
+
+
 # ============================================================================
 # Entry-point de desenvolvimento
 # ============================================================================
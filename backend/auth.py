@@ -1,13 +1,18 @@
 """Modulo de autenticacao — Senha + OTP por e-mail + SQLite (usuarios + cache + jobs)."""
 
+import atexit
+import heapq
+import itertools
 import json
 import os
-import random
+import queue
 import re
+import secrets
 import sqlite3
 import smtplib
 import threading
 import time
+import urllib.parse
 from contextlib import contextmanager
 from datetime import datetime
 from email.mime.multipart import MIMEMultipart
@@ -16,9 +21,10 @@ from email.mime.text import MIMEText
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from backend.config import (
-    DB_PATH, OTP_EXPIRY_MINUTES, OTP_MAX_ATTEMPTS,
+    DB_PATH, CACHE_MAX_ROWS, OTP_EXPIRY_MINUTES, OTP_MAX_ATTEMPTS,
     SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, SMTP_FROM, log,
 )
+from backend.rate_limit import get_redis
 
 DEFAULT_STORAGE_LIMIT = 524_288_000  # 500 MB
 
@@ -27,27 +33,87 @@ DEFAULT_STORAGE_LIMIT = 524_288_000  # 500 MB
 # SQLite
 # ============================================================================
 
-@contextmanager
-def _db_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+def _connect(readonly=False):
+    # timeout do sqlite3.connect (5 s) ja e o busy_timeout: com WAL, escritas
+    # concorrentes esperam o lock do SQLite em vez de um lock Python
+    if readonly:
+        # mode=ro: leitor nunca pega lock de escrita (WAL: le em paralelo)
+        conn = sqlite3.connect(
+            f'file:{urllib.parse.quote(DB_PATH)}?mode=ro', uri=True,
+            check_same_thread=False, timeout=5.0,
+        )
+    else:
+        # BEGIN IMMEDIATE: a transacao pega o lock de escrita logo no inicio,
+        # sem SQLITE_BUSY ao promover leitura para escrita
+        conn = sqlite3.connect(
+            DB_PATH, check_same_thread=False, timeout=5.0, isolation_level='IMMEDIATE',
+        )
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA synchronous=NORMAL')   # WAL: fsync so no checkpoint
+    conn.execute('PRAGMA cache_size=-20000')    # ~20 MB de page cache
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA mmap_size=268435456')  # leituras via mmap (ate 256 MB)
+    return conn
+
+
+# Pools de conexoes abertas (PRAGMAs aplicados uma vez por conexao): escritores
+# e leitores read-only separados. LIFO: a conexao mais recente tem o page cache
+# mais quente. Nao bloqueiam: pool vazio abre outra; na devolucao, o
+# excedente e fechado
+_POOL_SIZE = 8
+_pool = queue.LifoQueue(maxsize=_POOL_SIZE)
+_READ_POOL_SIZE = os.cpu_count() or 4
+_readers = queue.LifoQueue(maxsize=_READ_POOL_SIZE)
+
+
+@contextmanager
+def _pooled(pool, readonly):
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _connect(readonly)
     try:
         yield conn
         conn.commit()
     except Exception:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            # Conexao quebrada: descartar em vez de devolver ao pool
+            conn.close()
+            conn = None
         raise
     finally:
-        conn.close()
+        if conn is not None:
+            try:
+                pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+
+def _db_conn():
+    """Conexao de escrita (transacoes BEGIN IMMEDIATE)."""
+    return _pooled(_pool, readonly=False)
+
+
+def _read_conn():
+    """Conexao somente leitura (SELECTs; nao disputa o lock de escrita)."""
+    return _pooled(_readers, readonly=True)
 
 
 JOB_EXPIRY_DAYS = 7
-_db_lock = threading.Lock()
 
 
 def init_db():
     """Cria tabelas SQLite se nao existirem."""
     with _db_conn() as conn:
+        # Antes de qualquer tabela: so tem efeito em banco novo (banco existente
+        # precisa de um VACUUM manual para mudar de modo)
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            log.info('[DB] auto_vacuum inativo: rode VACUUM uma vez para liberar paginas da evicao do cache')
+        # Persistente no arquivo: basta uma vez (leituras nao esperam escritas)
+        conn.execute('PRAGMA journal_mode=WAL')
         conn.executescript("""
             CREATE TABLE IF NOT EXISTS users (
                 id            INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -111,6 +177,8 @@ def init_db():
             CREATE INDEX IF NOT EXISTS idx_activity_date ON activity_log(created_at);
             CREATE INDEX IF NOT EXISTS idx_job_history_email ON job_history(user_email);
             CREATE INDEX IF NOT EXISTS idx_job_history_expires ON job_history(expires_at);
+            CREATE INDEX IF NOT EXISTS idx_jobs_user_created ON jobs(user_email, created_at DESC);
+            CREATE INDEX IF NOT EXISTS idx_cache_last_used ON translation_cache(last_used_at);
         """)
 
         # Migracao: adicionar coluna password_hash se nao existir
@@ -136,6 +204,16 @@ def init_db():
         except sqlite3.OperationalError:
             pass  # coluna ja existe
 
+        # Migration: error_count na tabela jobs (listagem sem parsear errors)
+        try:
+            conn.execute("ALTER TABLE jobs ADD COLUMN error_count INTEGER DEFAULT 0")
+            conn.execute(
+                "UPDATE jobs SET error_count = json_array_length(errors) "
+                "WHERE json_valid(errors)"
+            )
+        except sqlite3.OperationalError:
+            pass  # coluna ja existe
+
     log.info('[AUTH] Banco de dados inicializado')
 
 
@@ -157,7 +235,7 @@ def get_or_create_user(email):
 
 def list_all_users():
     """Lista todos os usuarios (para painel admin)."""
-    with _db_conn() as conn:
+    with _read_conn() as conn:
         rows = conn.execute(
             "SELECT id, email, is_admin, created_at FROM users ORDER BY id"
         ).fetchall()
@@ -166,7 +244,7 @@ def list_all_users():
 
 def get_system_stats():
     """Retorna estatisticas do banco (para painel admin)."""
-    with _db_conn() as conn:
+    with _read_conn() as conn:
         user_count = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
         admin_count = conn.execute("SELECT COUNT(*) FROM users WHERE is_admin = 1").fetchone()[0]
         cache_count = conn.execute("SELECT COUNT(*) FROM translation_cache").fetchone()[0]
@@ -181,7 +259,7 @@ def get_system_stats():
 
 def get_user_by_id(user_id):
     """Busca usuario por ID."""
-    with _db_conn() as conn:
+    with _read_conn() as conn:
         row = conn.execute(
             "SELECT id, email, is_admin, created_at FROM users WHERE id = ?",
             (user_id,),
@@ -189,6 +267,16 @@ def get_user_by_id(user_id):
         return dict(row) if row else None
 
 
+def get_user_by_email(email):
+    """Busca usuario por e-mail (so leitura, inclui is_admin)."""
+    with _read_conn() as conn:
+        row = conn.execute(
+            "SELECT id, email, is_admin, created_at FROM users WHERE email = ?",
+            (email.strip().lower(),),
+        ).fetchone()
+        return dict(row) if row else None
+
+
 # ============================================================================
 # Autenticacao por senha
 # ============================================================================
@@ -263,7 +351,7 @@ def login_user(email, password):
     if not email or not password:
         return None, 'E-mail e senha sao obrigatorios.'
 
-    with _db_conn() as conn:
+    with _read_conn() as conn:
         row = conn.execute(
             "SELECT id, email, password_hash, created_at FROM users WHERE email = ?",
             (email,),
@@ -295,46 +383,62 @@ def login_user(email, password):
 def save_job_db(job_dict):
     """Salva ou atualiza job no SQLite (INSERT OR REPLACE)."""
     try:
-        with _db_lock:
-            with _db_conn() as conn:
-                conn.execute(
-                    """INSERT OR REPLACE INTO jobs
-                       (job_id, user_email, status, progress, total_files, files_done,
-                        total_strings, translated_strings, errors, validation,
-                        has_output, created_at, started_at, finished_at, file_size_bytes)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (
-                        job_dict['job_id'],
-                        job_dict['user_email'],
-                        job_dict['status'],
-                        job_dict.get('progress', 0),
-                        job_dict.get('total_files', 0),
-                        job_dict.get('files_done', 0),
-                        job_dict.get('total_strings', 0),
-                        job_dict.get('translated_strings', 0),
-                        json.dumps(job_dict.get('errors', [])),
-                        json.dumps(job_dict.get('validation')) if job_dict.get('validation') else None,
-                        1 if job_dict.get('has_output') else 0,
-                        job_dict['created_at'],
-                        job_dict.get('started_at'),
-                        job_dict.get('finished_at'),
-                        job_dict.get('file_size_bytes', 0),
-                    ),
-                )
+        with _db_conn() as conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO jobs
+                   (job_id, user_email, status, progress, total_files, files_done,
+                    total_strings, translated_strings, errors, error_count, validation,
+                    has_output, created_at, started_at, finished_at, file_size_bytes)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    job_dict['job_id'],
+                    job_dict['user_email'],
+                    job_dict['status'],
+                    job_dict.get('progress', 0),
+                    job_dict.get('total_files', 0),
+                    job_dict.get('files_done', 0),
+                    job_dict.get('total_strings', 0),
+                    job_dict.get('translated_strings', 0),
+                    json.dumps(job_dict.get('errors', [])),
+                    job_dict.get('error_count', len(job_dict.get('errors', []))),
+                    json.dumps(job_dict.get('validation')) if job_dict.get('validation') else None,
+                    1 if job_dict.get('has_output') else 0,
+                    job_dict['created_at'],
+                    job_dict.get('started_at'),
+                    job_dict.get('finished_at'),
+                    job_dict.get('file_size_bytes', 0),
+                ),
+            )
     except Exception as e:
         log.error(f'[DB] Erro ao salvar job: {e}')
 
 
-def get_jobs_db(user_email):
-    """Retorna lista de jobs do usuario (do mais recente ao mais antigo)."""
+# Colunas da listagem: sem errors/validation (JSON grande, so no detalhe)
+_JOB_SUMMARY_COLUMNS = (
+    'job_id, user_email, status, progress, total_files, files_done, '
+    'total_strings, translated_strings, error_count, has_output, '
+    'created_at, started_at, finished_at, file_size_bytes'
+)
+
+
+def get_jobs_summary_db(user_email):
+    """
+    Retorna resumo dos jobs do usuario (do mais recente ao mais antigo), sem
+    desserializar errors/validation. Detalhe completo em get_job_db().
+    """
     try:
-        with _db_lock:
-            with _db_conn() as conn:
-                rows = conn.execute(
-                    "SELECT * FROM jobs WHERE user_email = ? ORDER BY created_at DESC",
-                    (user_email,),
-                ).fetchall()
-                return [_row_to_job_dict(r) for r in rows]
+        with _read_conn() as conn:
+            rows = conn.execute(
+                f"SELECT {_JOB_SUMMARY_COLUMNS} FROM jobs "
+                "WHERE user_email = ? ORDER BY created_at DESC",
+                (user_email,),
+            ).fetchall()
+            result = []
+            for r in rows:
+                d = dict(r)
+                d['has_output'] = bool(d['has_output'])
+                result.append(d)
+            return result
     except Exception as e:
         log.error(f'[DB] Erro ao buscar jobs: {e}')
         return []
@@ -343,12 +447,11 @@ def get_jobs_db(user_email):
 def get_job_db(job_id):
     """Retorna um job do SQLite ou None."""
     try:
-        with _db_lock:
-            with _db_conn() as conn:
-                row = conn.execute(
-                    "SELECT * FROM jobs WHERE job_id = ?", (job_id,),
-                ).fetchone()
-                return _row_to_job_dict(row) if row else None
+        with _read_conn() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE job_id = ?", (job_id,),
+            ).fetchone()
+            return _row_to_job_dict(row) if row else None
     except Exception as e:
         log.error(f'[DB] Erro ao buscar job {job_id}: {e}')
         return None
@@ -357,9 +460,8 @@ def get_job_db(job_id):
 def delete_job_db(job_id):
     """Remove job do SQLite."""
     try:
-        with _db_lock:
-            with _db_conn() as conn:
-                conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        with _db_conn() as conn:
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
     except Exception as e:
         log.error(f'[DB] Erro ao deletar job {job_id}: {e}')
 
@@ -387,38 +489,36 @@ def _row_to_job_dict(row):
 def get_user_quota(email):
     """Retorna info de quota do usuario."""
     email = email.strip().lower()
-    with _db_lock:
-        with _db_conn() as conn:
-            row = conn.execute(
-                "SELECT storage_used_bytes, storage_limit_bytes FROM users WHERE email = ?",
-                (email,),
-            ).fetchone()
-            if not row:
-                return {'used_bytes': 0, 'limit_bytes': DEFAULT_STORAGE_LIMIT,
-                        'used_mb': 0, 'limit_mb': 500, 'percent': 0}
-            used = row['storage_used_bytes'] or 0
-            limit = row['storage_limit_bytes'] or DEFAULT_STORAGE_LIMIT
-            return {
-                'used_bytes': used,
-                'limit_bytes': limit,
-                'used_mb': round(used / (1024 * 1024), 1),
-                'limit_mb': round(limit / (1024 * 1024), 1),
-                'percent': round((used / limit) * 100, 1) if limit > 0 else 0,
-            }
+    with _read_conn() as conn:
+        row = conn.execute(
+            "SELECT storage_used_bytes, storage_limit_bytes FROM users WHERE email = ?",
+            (email,),
+        ).fetchone()
+        if not row:
+            return {'used_bytes': 0, 'limit_bytes': DEFAULT_STORAGE_LIMIT,
+                    'used_mb': 0, 'limit_mb': 500, 'percent': 0}
+        used = row['storage_used_bytes'] or 0
+        limit = row['storage_limit_bytes'] or DEFAULT_STORAGE_LIMIT
+        return {
+            'used_bytes': used,
+            'limit_bytes': limit,
+            'used_mb': round(used / (1024 * 1024), 1),
+            'limit_mb': round(limit / (1024 * 1024), 1),
+            'percent': round((used / limit) * 100, 1) if limit > 0 else 0,
+        }
 
 
 def update_storage_used(email, delta_bytes):
     """Atualiza storage_used_bytes do usuario (pode ser positivo ou negativo)."""
     email = email.strip().lower()
     try:
-        with _db_lock:
-            with _db_conn() as conn:
-                conn.execute(
-                    """UPDATE users
-                       SET storage_used_bytes = MAX(0, COALESCE(storage_used_bytes, 0) + ?)
-                       WHERE email = ?""",
-                    (delta_bytes, email),
-                )
+        with _db_conn() as conn:
+            conn.execute(
+                """UPDATE users
+                   SET storage_used_bytes = MAX(0, COALESCE(storage_used_bytes, 0) + ?)
+                   WHERE email = ?""",
+                (delta_bytes, email),
+            )
     except Exception as e:
         log.error(f'[QUOTA] Erro ao atualizar storage de {email}: {e}')
 
@@ -438,60 +538,174 @@ def check_storage_available(email, new_bytes):
 
 
 def get_cached_translation_db(source_text):
-    """Busca traducao no cache SQLite. Retorna string ou None."""
+    """
+    Busca traducao no cache SQLite. Retorna string ou None.
+    Leitura numa conexao read-only; o hit so incrementa _hit_buffer em
+    memoria (gravado a cada _HIT_FLUSH_INTERVAL por _db_maintenance_loop).
+    """
     try:
-        with _db_lock:
-            with _db_conn() as conn:
-                row = conn.execute(
-                    "SELECT translated_text FROM translation_cache WHERE source_text = ?",
-                    (source_text,),
-                ).fetchone()
-                if row:
-                    now = datetime.now().isoformat()
-                    conn.execute(
-                        "UPDATE translation_cache "
-                        "SET hit_count = hit_count + 1, last_used_at = ? "
-                        "WHERE source_text = ?",
-                        (now, source_text),
-                    )
-                    return row['translated_text']
+        with _read_conn() as conn:
+            row = conn.execute(
+                "SELECT translated_text FROM translation_cache WHERE source_text = ?",
+                (source_text,),
+            ).fetchone()
+        if row:
+            with _hit_lock:
+                _hit_buffer[source_text] = _hit_buffer.get(source_text, 0) + 1
+            return row['translated_text']
     except Exception as e:
         log.debug(f'[CACHE] Erro ao buscar cache: {e}')
     return None
 
 
+# Hits acumulados por texto: um UPDATE por chave distinta a cada intervalo,
+# em vez de um por hit
+_hit_buffer = {}
+_hit_lock = threading.Lock()
+_HIT_FLUSH_INTERVAL = 10  # segundos
+
+
+def _flush_cache_hits():
+    """Grava os hits acumulados numa unica transacao."""
+    global _hit_buffer
+    with _hit_lock:
+        if not _hit_buffer:
+            return
+        hits, _hit_buffer = _hit_buffer, {}
+    now = datetime.now().isoformat()
+    try:
+        with _db_conn() as conn:
+            conn.executemany(
+                "UPDATE translation_cache "
+                "SET hit_count = hit_count + ?, last_used_at = ? "
+                "WHERE source_text = ?",
+                [(count, now, text) for text, count in hits.items()],
+            )
+    except Exception as e:
+        log.debug(f'[CACHE] Erro ao registrar hits: {e}')
+
+
+# Chamados (na thread db-maintenance) depois que a evicao remove linhas;
+# ex: TwoLevelCache.rebuild_bloom
+_evict_listeners = []
+
+
+def add_cache_evict_listener(fn):
+    """Registra callback sem argumentos executado apos cada evicao do cache."""
+    _evict_listeners.append(fn)
+
+
+_CACHE_EVICT_EVERY = 360  # flushes de hits (~1 h) entre checagens do teto
+_DB_OPTIMIZE_EVERY = 90   # flushes de hits (~15 min) entre PRAGMA optimize
+_CACHE_EVICT_BATCH = 10_000  # linhas por transacao (nao segura o lock de escrita)
+
+
+def evict_translation_cache(max_rows=CACHE_MAX_ROWS):
+    """
+    Remove as traducoes menos usadas recentemente (last_used_at) ate o cache
+    voltar a max_rows linhas e devolve as paginas livres ao SO. Retorna o
+    numero de linhas removidas.
+    """
+    with _read_conn() as conn:
+        excess = conn.execute("SELECT COUNT(*) FROM translation_cache").fetchone()[0] - max_rows
+    removed = 0
+    while excess > 0:
+        with _db_conn() as conn:
+            deleted = conn.execute(
+                "DELETE FROM translation_cache WHERE rowid IN ("
+                "SELECT rowid FROM translation_cache ORDER BY last_used_at LIMIT ?)",
+                (min(excess, _CACHE_EVICT_BATCH),),
+            ).rowcount
+        if not deleted:
+            break
+        excess -= deleted
+        removed += deleted
+    if removed:
+        with _db_conn() as conn:
+            # Uma pagina por passo do statement: executescript (sqlite3_exec)
+            # roda ate o fim, execute() pararia no primeiro
+            conn.executescript('PRAGMA incremental_vacuum')
+        log.info(f'[CACHE] Evicao LRU: {removed} traducoes removidas (teto {max_rows})')
+    return removed
+
+
+def _db_maintenance_loop():
+    """Flush dos hits a cada _HIT_FLUSH_INTERVAL; evicao e optimize espacados."""
+    for i in itertools.count(1):
+        time.sleep(_HIT_FLUSH_INTERVAL)
+        _flush_cache_hits()
+        if i % _CACHE_EVICT_EVERY == 0:
+            try:
+                if evict_translation_cache():
+                    for fn in _evict_listeners:
+                        fn()
+            except Exception as e:
+                log.warning(f'[CACHE] Erro na evicao: {e}')
+        if i % _DB_OPTIMIZE_EVERY == 0:
+            try:
+                # Atualiza estatisticas do planner so onde fizer diferenca
+                with _db_conn() as conn:
+                    conn.execute('PRAGMA optimize')
+            except Exception as e:
+                log.debug(f'[DB] Erro no PRAGMA optimize: {e}')
+
+
+atexit.register(_flush_cache_hits)
+threading.Thread(target=_db_maintenance_loop, daemon=True, name='db-maintenance').start()
+
+
 def save_cached_translation_db(source_text, translated_text):
     """Salva traducao no cache SQLite (INSERT OR UPDATE)."""
     now = datetime.now().isoformat()
     try:
-        with _db_lock:
-            with _db_conn() as conn:
-                conn.execute(
-                    """
-                    INSERT INTO translation_cache
-                        (source_text, translated_text, hit_count, created_at, last_used_at)
-                    VALUES (?, ?, 1, ?, ?)
-                    ON CONFLICT(source_text) DO UPDATE SET
-                        hit_count    = hit_count + 1,
-                        last_used_at = excluded.last_used_at
-                    """,
-                    (source_text, translated_text, now, now),
-                )
+        with _db_conn() as conn:
+            conn.execute(
+                """
+                INSERT INTO translation_cache
+                    (source_text, translated_text, hit_count, created_at, last_used_at)
+                VALUES (?, ?, 1, ?, ?)
+                ON CONFLICT(source_text) DO UPDATE SET
+                    hit_count    = hit_count + 1,
+                    last_used_at = excluded.last_used_at
+                """,
+                (source_text, translated_text, now, now),
+            )
     except Exception as e:
         log.debug(f'[CACHE] Erro ao salvar cache: {e}')
 
 
+def save_cached_translations_db(pairs):
+    """Salva varias traducoes numa unica transacao (executemany)."""
+    if not pairs:
+        return
+    now = datetime.now().isoformat()
+    try:
+        with _db_conn() as conn:
+            conn.executemany(
+                """
+                INSERT INTO translation_cache
+                    (source_text, translated_text, hit_count, created_at, last_used_at)
+                VALUES (?, ?, 1, ?, ?)
+                ON CONFLICT(source_text) DO UPDATE SET
+                    hit_count    = hit_count + 1,
+                    last_used_at = excluded.last_used_at
+                """,
+                [(src, dst, now, now) for src, dst in pairs],
+            )
+    except Exception as e:
+        log.debug(f'[CACHE] Erro ao salvar cache em lote: {e}')
+
+
 def clear_untranslated_cache():
     """Remove entradas do cache onde a traducao e igual ao original."""
     try:
-        with _db_lock:
-            with _db_conn() as conn:
-                deleted = conn.execute(
-                    "DELETE FROM translation_cache "
-                    "WHERE LOWER(TRIM(source_text)) = LOWER(TRIM(translated_text))"
-                ).rowcount
-                log.info(f'[CACHE] Limpeza: {deleted} traducoes falhadas removidas do cache')
-                return deleted
+        with _db_conn() as conn:
+            deleted = conn.execute(
+                "DELETE FROM translation_cache "
+                "WHERE LOWER(TRIM(source_text)) = LOWER(TRIM(translated_text))"
+            ).rowcount
+            log.info(f'[CACHE] Limpeza: {deleted} traducoes falhadas removidas do cache')
+            return deleted
     except Exception as e:
         log.error(f'[CACHE] Erro ao limpar cache: {e}')
         return 0
@@ -502,23 +716,33 @@ def clear_untranslated_cache():
 # ============================================================================
 
 def log_activity(user_email, action, details=None, ip_address=None):
-    """Registra acao do usuario no log de atividades."""
-    now = datetime.now().isoformat()
+    """
+    Registra acao do usuario no log de atividades.
+    A escrita no SQLite e feita em lote pela fila em background (_bg_loop).
+    """
+    row = (user_email, action, details, ip_address, datetime.now().isoformat())
+    try:
+        _bgq.put_nowait(('activity', row))
+    except queue.Full:
+        log.debug(f'[ACTIVITY] Fila cheia, atividade descartada: {action}')
+
+
+def _write_activity_batch(rows):
+    """Grava varias atividades numa unica transacao."""
     try:
-        with _db_lock:
-            with _db_conn() as conn:
-                conn.execute(
-                    "INSERT INTO activity_log (user_email, action, details, ip_address, created_at) "
-                    "VALUES (?, ?, ?, ?, ?)",
-                    (user_email, action, details, ip_address, now),
-                )
+        with _db_conn() as conn:
+            conn.executemany(
+                "INSERT INTO activity_log (user_email, action, details, ip_address, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
     except Exception as e:
         log.debug(f'[ACTIVITY] Erro ao registrar atividade: {e}')
 
 
 def get_user_activity(user_email, limit=50, offset=0):
     """Retorna historico de atividades de um usuario."""
-    with _db_conn() as conn:
+    with _read_conn() as conn:
         rows = conn.execute(
             "SELECT action, details, ip_address, created_at FROM activity_log "
             "WHERE user_email = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
@@ -529,7 +753,7 @@ def get_user_activity(user_email, limit=50, offset=0):
 
 def get_all_activity(limit=100, offset=0):
     """Retorna historico de atividades de todos os usuarios (admin)."""
-    with _db_conn() as conn:
+    with _read_conn() as conn:
         rows = conn.execute(
             "SELECT user_email, action, details, ip_address, created_at FROM activity_log "
             "ORDER BY created_at DESC LIMIT ? OFFSET ?",
@@ -548,29 +772,28 @@ def save_job_history(job_dict):
     now = datetime.now()
     expires = (now + timedelta(days=JOB_EXPIRY_DAYS)).isoformat()
     try:
-        with _db_lock:
-            with _db_conn() as conn:
-                conn.execute(
-                    """INSERT OR REPLACE INTO job_history
-                    (job_id, user_email, status, total_files, total_strings,
-                     translated_strings, created_at, started_at, finished_at,
-                     expires_at, file_available, file_size_bytes)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?)""",
-                    (
-                        job_dict['job_id'], job_dict['user_email'], job_dict['status'],
-                        job_dict.get('total_files', 0), job_dict.get('total_strings', 0),
-                        job_dict.get('translated_strings', 0), job_dict.get('created_at', ''),
-                        job_dict.get('started_at'), job_dict.get('finished_at'),
-                        expires, job_dict.get('file_size_bytes', 0),
-                    ),
-                )
+        with _db_conn() as conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO job_history
+                (job_id, user_email, status, total_files, total_strings,
+                 translated_strings, created_at, started_at, finished_at,
+                 expires_at, file_available, file_size_bytes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?)""",
+                (
+                    job_dict['job_id'], job_dict['user_email'], job_dict['status'],
+                    job_dict.get('total_files', 0), job_dict.get('total_strings', 0),
+                    job_dict.get('translated_strings', 0), job_dict.get('created_at', ''),
+                    job_dict.get('started_at'), job_dict.get('finished_at'),
+                    expires, job_dict.get('file_size_bytes', 0),
+                ),
+            )
     except Exception as e:
         log.debug(f'[JOB_HISTORY] Erro ao salvar: {e}')
 
 
 def get_user_job_history(user_email, limit=50):
     """Retorna historico de jobs de um usuario."""
-    with _db_conn() as conn:
+    with _read_conn() as conn:
         rows = conn.execute(
             "SELECT job_id, status, total_files, total_strings, translated_strings, "
             "created_at, started_at, finished_at, expires_at, file_available, "
@@ -584,7 +807,7 @@ def get_user_job_history(user_email, limit=50):
 
 def get_all_job_history(limit=100):
     """Retorna historico de jobs de todos os usuarios (admin)."""
-    with _db_conn() as conn:
+    with _read_conn() as conn:
         rows = conn.execute(
             "SELECT job_id, user_email, status, total_files, total_strings, "
             "translated_strings, created_at, started_at, finished_at, "
@@ -597,7 +820,7 @@ def get_all_job_history(limit=100):
 
 def get_job_history_entry(job_id):
     """Retorna um registro do historico pelo job_id, ou None."""
-    with _db_conn() as conn:
+    with _read_conn() as conn:
         row = conn.execute(
             "SELECT job_id, user_email, status, total_files, total_strings, "
             "translated_strings, created_at, started_at, finished_at, "
@@ -611,12 +834,11 @@ def get_job_history_entry(job_id):
 def mark_job_files_expired(job_id):
     """Marca file_available=0 para um job especifico no historico."""
     try:
-        with _db_lock:
-            with _db_conn() as conn:
-                conn.execute(
-                    "UPDATE job_history SET file_available = 0 WHERE job_id = ?",
-                    (job_id,),
-                )
+        with _db_conn() as conn:
+            conn.execute(
+                "UPDATE job_history SET file_available = 0 WHERE job_id = ?",
+                (job_id,),
+            )
     except Exception as e:
         log.error(f'[JOB_HISTORY] Erro ao marcar expirado {job_id}: {e}')
 
@@ -624,16 +846,15 @@ def mark_job_files_expired(job_id):
 def delete_job_history_entry(job_id):
     """Remove registro do job_history. Activity log ja serve como auditoria."""
     try:
-        with _db_lock:
-            with _db_conn() as conn:
-                conn.execute("DELETE FROM job_history WHERE job_id = ?", (job_id,))
+        with _db_conn() as conn:
+            conn.execute("DELETE FROM job_history WHERE job_id = ?", (job_id,))
     except Exception as e:
         log.error(f'[JOB_HISTORY] Erro ao deletar {job_id}: {e}')
 
 
 def get_user_deletable_jobs(user_email, limit=10):
     """Retorna jobs do usuario com arquivos disponiveis, maiores primeiro."""
-    with _db_conn() as conn:
+    with _read_conn() as conn:
         rows = conn.execute(
             "SELECT job_id, COALESCE(file_size_bytes, 0) as file_size_bytes, "
             "created_at, expires_at "
@@ -655,21 +876,17 @@ def cleanup_expired_jobs():
     """Remove registros expirados do job_history e retorna job_ids para limpeza de arquivos."""
     now = datetime.now().isoformat()
     try:
-        with _db_lock:
-            with _db_conn() as conn:
-                rows = conn.execute(
-                    "SELECT job_id FROM job_history "
-                    "WHERE file_available = 1 AND expires_at < ?",
-                    (now,),
-                ).fetchall()
-                expired_ids = [r['job_id'] for r in rows]
-                if expired_ids:
-                    conn.execute(
-                        "DELETE FROM job_history WHERE file_available = 1 AND expires_at < ?",
-                        (now,),
-                    )
-                    log.info(f'[JOB_HISTORY] {len(expired_ids)} jobs expirados removidos')
-                return expired_ids
+        with _db_conn() as conn:
+            # Um unico statement: sem janela entre o SELECT e o DELETE
+            rows = conn.execute(
+                "DELETE FROM job_history WHERE file_available = 1 AND expires_at < ? "
+                "RETURNING job_id",
+                (now,),
+            ).fetchall()
+            expired_ids = [r['job_id'] for r in rows]
+            if expired_ids:
+                log.info(f'[JOB_HISTORY] {len(expired_ids)} jobs expirados removidos')
+            return expired_ids
     except Exception as e:
         log.error(f'[JOB_HISTORY] Erro ao limpar expirados: {e}')
         return []
@@ -691,15 +908,68 @@ def delete_user_account(user_id):
 
 
 # ============================================================================
-# OTP em memoria
+# OTP (Redis se configurado, senao memoria do processo)
 # ============================================================================
 
-_otps = {}           # {email: {code, expires_at, attempts, sent_at}}
-_otp_lock = threading.Lock()
+# Com REDIS_URL os codigos ficam num hash otp:<email> (TTL = validade) e o
+# bloqueio de reenvio em otp:<email>:sent (SET NX EX): funciona com varios
+# workers. Sem Redis, dict em memoria (suficiente com --workers 1).
+
+# KEYS[1]=otp:<email>  ARGV: codigo, max_tentativas
+# Retorna -1 (sem codigo), 0 (valido) ou o numero de tentativas apos o erro
+_OTP_VERIFY_LUA = """
+local code = redis.call('HGET', KEYS[1], 'code')
+if not code then return -1 end
+local attempts = redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+local max = tonumber(ARGV[2])
+if attempts <= max and code == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+if attempts >= max then redis.call('DEL', KEYS[1]) end
+return attempts
+"""
+
+_redis = get_redis()
+_otp_verify_script = _redis.register_script(_OTP_VERIFY_LUA) if _redis is not None else None
+
+# Fatias por hash do e-mail: {email: {code, expires_at, attempts, sent_at}} +
+# lock proprio, logins de e-mails diferentes raramente disputam o mesmo lock
+_OTP_SHARDS = 8
+_otp_shards = [({}, threading.Lock()) for _ in range(_OTP_SHARDS)]
+
+# Heap (expires_at, email): codigo pedido e nunca verificado sai pela cabeca
+# do heap no proximo acesso, sem varrer os dicts
+_otp_expiry = []
+_otp_expiry_lock = threading.Lock()
 
 OTP_RESEND_SECONDS = 60  # Rate limit de reenvio por e-mail
 
 
+def _otp_shard(email):
+    return _otp_shards[hash(email) % _OTP_SHARDS]
+
+
+def _otp_sweep(now):
+    """Remove os codigos expirados (sweep on access)."""
+    expired = []
+    with _otp_expiry_lock:
+        while _otp_expiry and _otp_expiry[0][0] < now:
+            expired.append(heapq.heappop(_otp_expiry))
+    for expires_at, email in expired:
+        otps, lock = _otp_shard(email)
+        with lock:
+            entry = otps.get(email)
+            # Codigo reenviado tem outro expires_at: item do heap obsoleto
+            if entry is not None and entry['expires_at'] == expires_at:
+                del otps[email]
+
+
+def _new_otp_code():
+    # CSPRNG: o codigo e a credencial de login, nao pode vir do Mersenne Twister
+    return f"{secrets.randbelow(1_000_000):06d}"
+
+
 def generate_otp(email):
     """
     Gera codigo OTP de 6 digitos para o e-mail.
@@ -707,22 +977,62 @@ def generate_otp(email):
     Retorna (None, remaining_seconds) se rate limit ativo.
     """
     email = email.strip().lower()
-    now = time.time()
 
-    with _otp_lock:
-        existing = _otps.get(email)
+    if _redis is not None:
+        try:
+            return _generate_otp_redis(email)
+        except Exception as e:
+            log.error(f'[AUTH] Erro no Redis (OTP), usando memoria: {e}')
+
+    now = time.time()
+    _otp_sweep(now)
+    otps, lock = _otp_shard(email)
+    with lock:
+        existing = otps.get(email)
         if existing and now - existing['sent_at'] < OTP_RESEND_SECONDS:
             remaining = int(OTP_RESEND_SECONDS - (now - existing['sent_at']))
             return None, remaining
 
-        code = f"{random.randint(0, 999999):06d}"
-        _otps[email] = {
+        code = _new_otp_code()
+        expires_at = now + OTP_EXPIRY_MINUTES * 60
+        otps[email] = {
             'code': code,
-            'expires_at': now + OTP_EXPIRY_MINUTES * 60,
+            'expires_at': expires_at,
             'attempts': 0,
             'sent_at': now,
         }
-        return code, 0
+
+    with _otp_expiry_lock:
+        heapq.heappush(_otp_expiry, (expires_at, email))
+    return code, 0
+
+
+def _generate_otp_redis(email):
+    if not _redis.set(f'otp:{email}:sent', 1, ex=OTP_RESEND_SECONDS, nx=True):
+        return None, max(_redis.ttl(f'otp:{email}:sent'), 1)
+
+    code = _new_otp_code()
+    pipe = _redis.pipeline()
+    pipe.delete(f'otp:{email}')
+    pipe.hset(f'otp:{email}', mapping={'code': code, 'attempts': 0})
+    pipe.expire(f'otp:{email}', OTP_EXPIRY_MINUTES * 60)
+    pipe.execute()
+    return code, 0
+
+
+def _verify_otp_redis(email, code):
+    result = _otp_verify_script(keys=[f'otp:{email}'], args=[code.strip(), OTP_MAX_ATTEMPTS])
+    if result == -1:
+        # Expirado some pelo TTL: mesma resposta de "nunca pedido"
+        return False, 'Nenhum codigo solicitado (ou codigo expirado). Solicite um novo.'
+    if result == 0:
+        return True, None
+    if result > OTP_MAX_ATTEMPTS:
+        return False, 'Muitas tentativas. Solicite um novo codigo.'
+    remaining = OTP_MAX_ATTEMPTS - result
+    if remaining <= 0:
+        return False, 'Codigo incorreto. Solicite um novo codigo.'
+    return False, f'Codigo incorreto. {remaining} tentativa(s) restante(s).'
 
 
 def verify_otp(email, code):
@@ -732,32 +1042,40 @@ def verify_otp(email, code):
     Retorna (False, 'motivo') se invalido.
     """
     email = email.strip().lower()
-    now = time.time()
 
-    with _otp_lock:
-        entry = _otps.get(email)
+    if _redis is not None:
+        try:
+            return _verify_otp_redis(email, code)
+        except Exception as e:
+            log.error(f'[AUTH] Erro no Redis (OTP), usando memoria: {e}')
+
+    now = time.time()
+    _otp_sweep(now)
+    otps, lock = _otp_shard(email)
+    with lock:
+        entry = otps.get(email)
 
         if not entry:
             return False, 'Nenhum codigo solicitado para este e-mail.'
 
         if now > entry['expires_at']:
-            del _otps[email]
+            del otps[email]
             return False, 'Codigo expirado. Solicite um novo.'
 
         entry['attempts'] += 1
 
         if entry['attempts'] > OTP_MAX_ATTEMPTS:
-            del _otps[email]
+            del otps[email]
             return False, 'Muitas tentativas. Solicite um novo codigo.'
 
         if entry['code'] != code.strip():
             remaining = OTP_MAX_ATTEMPTS - entry['attempts']
             if remaining <= 0:
-                del _otps[email]
+                del otps[email]
                 return False, 'Codigo incorreto. Solicite um novo codigo.'
             return False, f'Codigo incorreto. {remaining} tentativa(s) restante(s).'
 
-        del _otps[email]
+        del otps[email]
         return True, None
 
 
@@ -765,15 +1083,8 @@ def verify_otp(email, code):
 # Envio de e-mail via smtplib
 # ============================================================================
 
-def send_otp_email(email, code):
-    """Envia e-mail com codigo OTP. Se SMTP nao configurado, imprime no log."""
-    if not SMTP_USER or not SMTP_PASS:
-        log.info(f'[AUTH] OTP para {email}: {code}  (SMTP nao configurado — apenas log)')
-        return
-
-    subject = f'Seu codigo de acesso: {code}'
-
-    html_body = f"""<!DOCTYPE html>
+# Corpo HTML renderizado uma vez no import; por envio so entra o codigo
+_OTP_HTML = f"""<!DOCTYPE html>
 <html>
 <head><meta charset="UTF-8"></head>
 <body style="margin:0;padding:0;background:#111827;font-family:system-ui,-apple-system,sans-serif">
@@ -808,7 +1119,7 @@ def send_otp_email(email, code):
               <div style="background:#111827;border:1px solid #374151;border-radius:8px;
                           text-align:center;padding:20px 16px">
                 <span style="font-size:40px;font-weight:700;letter-spacing:14px;
-                             color:#fff;font-family:monospace">{code}</span>
+                             color:#fff;font-family:monospace">{{code}}</span>
               </div>
             </td>
           </tr>
@@ -826,25 +1137,144 @@ def send_otp_email(email, code):
 </body>
 </html>"""
 
+
+# Conexao SMTP reaproveitada entre envios proximos (sem handshake TLS + login
+# por e-mail). Usada pela thread bg-writer, que a fecha apos _SMTP_IDLE
+# segundos sem envios; _smtp_lock cobre o envio sincrono de fallback.
+_smtp = None
+_smtp_lock = threading.Lock()
+_SMTP_IDLE = 30  # segundos
+
+
+def _smtp_connect():
+    # Porta 465 = SSL implicito (SMTPS); demais = STARTTLS
+    if SMTP_PORT == 465:
+        server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=10)
+    else:
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10)
+        server.ehlo()
+        server.starttls()
+    server.login(SMTP_USER, SMTP_PASS)
+    return server
+
+
+def _smtp_close():
+    """Fecha a conexao SMTP ociosa, se houver."""
+    global _smtp
+    with _smtp_lock:
+        server, _smtp = _smtp, None
+    if server is not None:
+        try:
+            server.quit()
+        except Exception:
+            pass
+
+
+def _smtp_sendmail(to_addr, message):
+    global _smtp
+    with _smtp_lock:
+        if _smtp is not None:
+            try:
+                _smtp.sendmail(SMTP_FROM, [to_addr], message)
+                return
+            except (smtplib.SMTPServerDisconnected, OSError):
+                # Servidor derrubou a conexao ociosa: reconectar uma vez
+                _smtp = None
+        server = _smtp_connect()
+        try:
+            server.sendmail(SMTP_FROM, [to_addr], message)
+        except Exception:
+            server.close()
+            raise
+        _smtp = server
+
+
+def send_otp_email(email, code):
+    """Envia e-mail com codigo OTP. Se SMTP nao configurado, imprime no log."""
+    if not SMTP_USER or not SMTP_PASS:
+        log.info(f'[AUTH] OTP para {email}: {code}  (SMTP nao configurado — apenas log)')
+        return
+
     msg = MIMEMultipart('alternative')
-    msg['Subject'] = subject
+    msg['Subject'] = f'Seu codigo de acesso: {code}'
     msg['From'] = SMTP_FROM
     msg['To'] = email
-    msg.attach(MIMEText(html_body, 'html', 'utf-8'))
+    msg.attach(MIMEText(_OTP_HTML.format(code=code), 'html', 'utf-8'))
 
     try:
-        # Porta 465 = SSL implicito (SMTPS); demais = STARTTLS
-        if SMTP_PORT == 465:
-            with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=10) as server:
-                server.login(SMTP_USER, SMTP_PASS)
-                server.sendmail(SMTP_FROM, [email], msg.as_string())
-        else:
-            with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10) as server:
-                server.ehlo()
-                server.starttls()
-                server.login(SMTP_USER, SMTP_PASS)
-                server.sendmail(SMTP_FROM, [email], msg.as_string())
+        _smtp_sendmail(email, msg.as_string())
         log.info(f'[AUTH] OTP enviado para {email}')
     except Exception as e:
         log.error(f'[AUTH] Erro ao enviar OTP para {email}: {e}')
         raise RuntimeError(f'Erro ao enviar e-mail: {e}')
+
+
+def send_otp_email_async(email, code):
+    """Enfileira o envio do OTP (SMTP fora da requisicao). Erros vao para o log."""
+    try:
+        _bgq.put_nowait(('email', email, code))
+    except queue.Full:
+        send_otp_email(email, code)
+
+
+# ============================================================================
+# Fila em background — e-mails e activity log fora do caminho da requisicao
+# ============================================================================
+
+_bgq = queue.Queue(maxsize=10_000)
+_BG_BATCH = 64  # atividades por transacao
+
+
+def _bg_process(items):
+    """Processa um lote da fila: atividades num executemany, e-mails um a um."""
+    activities = []
+    for item in items:
+        if item[0] == 'activity':
+            activities.append(item[1])
+        elif item[0] == 'email':
+            try:
+                send_otp_email(item[1], item[2])
+            except Exception:
+                pass  # send_otp_email ja registrou o erro
+    if activities:
+        _write_activity_batch(activities)
+
+
+def _bg_drain(block=True, timeout=None):
+    """Retira ate _BG_BATCH itens da fila (bloqueando so no primeiro)."""
+    items = []
+    try:
+        items.append(_bgq.get(block=block, timeout=timeout))
+        while len(items) < _BG_BATCH:
+            items.append(_bgq.get_nowait())
+    except queue.Empty:
+        pass
+    return items
+
+
+def _bg_loop():
+    """Thread daemon que esvazia a fila em lotes."""
+    while True:
+        # Com conexao SMTP aberta, acordar apos _SMTP_IDLE para fecha-la
+        items = _bg_drain(timeout=_SMTP_IDLE if _smtp is not None else None)
+        if not items:
+            _smtp_close()
+            continue
+        try:
+            _bg_process(items)
+        except Exception as e:
+            log.error(f'[BG] Erro ao processar fila: {e}')
+
+
+@atexit.register
+def _bg_flush():
+    """Grava o que ficou na fila ao encerrar o processo."""
+    while True:
+        items = _bg_drain(block=False)
+        if not items:
+            break
+        _bg_process(items)
+    _smtp_close()
+
+
+threading.Thread(target=_bg_loop, daemon=True, name='bg-writer').start()
@@ -12,6 +12,8 @@ UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 JOBS_FOLDER = os.path.join(BASE_DIR, 'jobs')
 STATIC_FOLDER = os.path.join(BASE_DIR, 'static')
 LOG_FILE = os.path.join(BASE_DIR, 'trans-script.log')
+# Nivel do logger (arquivo): INFO em producao evita montar as mensagens DEBUG
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG').upper()
 
 # Limites
 MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100 MB
@@ -27,6 +29,8 @@ TARGET_LANG = 'pt-br'
 DEEPL_API_KEY = os.environ.get('DEEPL_API_KEY', '')
 MYMEMORY_EMAIL = os.environ.get('MYMEMORY_EMAIL', '')
 CACHE_MEMORY_SIZE = int(os.environ.get('CACHE_MEMORY_SIZE', '10000'))
+# Teto de linhas do translation_cache no SQLite (evicao LRU por last_used_at)
+CACHE_MAX_ROWS = int(os.environ.get('CACHE_MAX_ROWS', '1000000'))
 
 # Autenticacao
 SECRET_KEY = os.environ.get('SECRET_KEY', os.urandom(32).hex())
@@ -42,6 +46,13 @@ ADMIN_EMAILS = [
     if e.strip()
 ]
 
+# Downloads entregues pelo Nginx (X-Accel-Redirect) em vez do Python.
+# So ativar atras do config/nginx.conf (location interna /_protected/jobs/).
+X_ACCEL_REDIRECT = os.environ.get('X_ACCEL_REDIRECT', '').lower() in ('1', 'true', 'yes')
+
+# Rate limit e OTP compartilhados entre workers (opcional): ex. redis://localhost:6379/0
+REDIS_URL = os.environ.get('REDIS_URL', '')
+
 # SMTP (via variaveis de ambiente)
 SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
 SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
@@ -59,7 +70,11 @@ for _folder in [UPLOAD_FOLDER, JOBS_FOLDER]:
 # ============================================================================
 
 def setup_logging():
-    """Configura logging para console + arquivo."""
+    """Configura logging para console + arquivo (idempotente: sem handlers duplicados)."""
+    root = logging.getLogger('trans-script')
+    if root.handlers:
+        return root
+
     fmt = logging.Formatter(
         '[%(asctime)s] %(levelname)s %(name)s: %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S',
@@ -75,8 +90,7 @@ def setup_logging():
     ch.setLevel(logging.INFO)
     ch.setFormatter(fmt)
 
-    root = logging.getLogger('trans-script')
-    root.setLevel(logging.DEBUG)
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.DEBUG))
     root.addHandler(fh)
     root.addHandler(ch)
 
@@ -4,10 +4,13 @@ import os
 import threading
 from typing import Optional
 
-from backend.config import log
+from backend.config import CACHE_MAX_ROWS, log
 from backend.engine.engine import TranslationEngine
 from backend.engine.cache import TwoLevelCache
-from backend.auth import get_cached_translation_db, save_cached_translation_db
+from backend.auth import (
+    add_cache_evict_listener,
+    get_cached_translation_db, save_cached_translation_db, save_cached_translations_db,
+)
 
 _engine: Optional[TranslationEngine] = None
 _engine_lock = threading.Lock()
@@ -28,8 +31,12 @@ def get_engine() -> TranslationEngine:
             db_get_fn=get_cached_translation_db,
             db_save_fn=save_cached_translation_db,
             max_memory=int(os.environ.get('CACHE_MEMORY_SIZE', '10000')),
+            db_save_many_fn=save_cached_translations_db,
+            bloom_capacity=CACHE_MAX_ROWS,
         )
         cache.warm_up()
+        # Evicao LRU remove linhas: filtro de Bloom e remontado em seguida
+        add_cache_evict_listener(cache.rebuild_bloom)
 
         # Montar chain de providers
         providers = []
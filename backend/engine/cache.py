@@ -1,57 +1,126 @@
 """Cache de traducoes em 2 niveis: memoria (LRU) + SQLite (persistente)."""
 
+import hashlib
+import math
 import threading
 from collections import OrderedDict
-from typing import Callable, Optional, Tuple
+from typing import Callable, List, Optional, Tuple
 
 from backend.config import log
 
 
-class TwoLevelCache:
+_L1_SHARDS = 16  # potencia de 2 (indice por mascara)
+
+
+class _BloomFilter:
     """
-    Nivel 1: OrderedDict em memoria (LRU, max 10k entradas)
-    Nivel 2: SQLite (tabela translation_cache existente)
+    Filtro de Bloom (bytearray + blake2b, double hashing): responde "com
+    certeza ausente" sem consultar o SQLite. Falso positivo so custa a
+    consulta que ja seria feita; remocoes no SQLite (evicao, limpeza) nao
+    saem do filtro, o que tambem so gera falso positivo.
     """
 
-    def __init__(self, db_get_fn: Callable, db_save_fn: Callable,
-                 max_memory: int = 10_000):
-        self._l1: OrderedDict = OrderedDict()
-        self._max_memory = max_memory
-        self._lock = threading.Lock()
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(1, capacity)
+        self._m = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self._k = max(1, round(self._m / capacity * math.log(2)))
+        self._bits = bytearray((self._m + 7) // 8)
+        self._lock = threading.Lock()  # |= nao e atomico entre threads
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        m = self._m
+        return [(h1 + i * h2) % m for i in range(self._k)]
+
+    def add(self, key: str):
+        positions = self._positions(key)
+        bits = self._bits
+        with self._lock:
+            for pos in positions:
+                bits[pos >> 3] |= 1 << (pos & 7)
 
-        self._db_get = db_get_fn
-        self._db_save = db_save_fn
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
 
+
+class _L1Shard:
+    """Fatia do L1: LRU proprio, lock proprio e contadores proprios."""
+
+    __slots__ = ('lru', 'lock', 'max_size', 'hits_l1', 'hits_l2', 'misses', 'lookups')
+
+    def __init__(self, max_size: int):
+        self.lru: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_size = max_size
         self.hits_l1 = 0
         self.hits_l2 = 0
         self.misses = 0
-        self.total_lookups = 0
+        self.lookups = 0
 
-    def get(self, text: str) -> Tuple[Optional[str], str]:
-        """Busca traducao. Retorna (traducao, nivel) onde nivel e 'l1', 'l2', ou 'miss'."""
-        key = text.strip()
 
-        with self._lock:
-            self.total_lookups += 1
-            if key in self._l1:
-                self._l1.move_to_end(key)
-                self.hits_l1 += 1
-                return self._l1[key], 'l1'
+class TwoLevelCache:
+    """
+    Nivel 1: OrderedDict em memoria (LRU, max 10k entradas), dividido em
+             _L1_SHARDS fatias por hash da chave: threads de traducao so
+             disputam o lock quando caem na mesma fatia
+    Nivel 2: SQLite (tabela translation_cache existente), precedido por um
+             filtro de Bloom das chaves persistidas quando bloom_capacity > 0:
+             texto nunca traduzido vira miss sem SELECT
+    """
 
-        db_result = self._db_get(key)
+    def __init__(self, db_get_fn: Callable, db_save_fn: Callable,
+                 max_memory: int = 10_000,
+                 db_save_many_fn: Optional[Callable] = None,
+                 bloom_capacity: int = 0):
+        self._max_memory = max_memory
+        self._bloom_capacity = bloom_capacity
+        # So consultado depois de montado com todas as chaves do SQLite (em
+        # background, ver rebuild_bloom); ate la, miss no L1 consulta o SQLite
+        self._bloom: Optional[_BloomFilter] = None
+        self._bloom_building: Optional[_BloomFilter] = None
+        self._bloom_build_lock = threading.Lock()
+        per_shard = max(1, max_memory // _L1_SHARDS)
+        self._shards = [_L1Shard(per_shard) for _ in range(_L1_SHARDS)]
+
+        self._db_get = db_get_fn
+        self._db_save = db_save_fn
+        self._db_save_many = db_save_many_fn
+
+    def _shard(self, key: str) -> _L1Shard:
+        return self._shards[hash(key) & (_L1_SHARDS - 1)]
+
+    def get(self, key: str) -> Tuple[Optional[str], str]:
+        """
+        Busca traducao. Retorna (traducao, nivel) onde nivel e 'l1', 'l2', ou 'miss'.
+        `key` ja vem canonico (texto com strip(), feito uma vez pela engine).
+        """
+        shard = self._shard(key)
+
+        with shard.lock:
+            shard.lookups += 1
+            value = shard.lru.get(key)
+            if value is not None:
+                shard.lru.move_to_end(key)
+                shard.hits_l1 += 1
+                return value, 'l1'
+
+        bloom = self._bloom
+        db_result = self._db_get(key) if bloom is None or key in bloom else None
         if db_result:
-            with self._lock:
-                self.hits_l2 += 1
+            with shard.lock:
+                shard.hits_l2 += 1
             self._put_l1(key, db_result)
             return db_result, 'l2'
 
-        with self._lock:
-            self.misses += 1
+        with shard.lock:
+            shard.misses += 1
         return None, 'miss'
 
-    def put(self, text: str, translated: str, persist: bool = True):
-        """Salva traducao nos 2 niveis."""
-        key = text.strip()
+    def put(self, key: str, translated: str, persist: bool = True):
+        """Salva traducao nos 2 niveis (`key` canonico, como em get)."""
         self._put_l1(key, translated)
 
         if persist:
@@ -59,44 +128,108 @@ class TwoLevelCache:
                 self._db_save(key, translated)
             except Exception as e:
                 log.debug(f'[CACHE] Erro ao persistir: {e}')
+            self._bloom_add((key,))
+
+    def put_many(self, pairs: List[Tuple[str, str]], persist: bool = True):
+        """Salva varias traducoes (chaves canonicas): L1 uma a uma, SQLite numa so transacao."""
+        for key, translated in pairs:
+            self._put_l1(key, translated)
+
+        if persist and pairs:
+            try:
+                if self._db_save_many is not None:
+                    self._db_save_many(pairs)
+                else:
+                    for key, translated in pairs:
+                        self._db_save(key, translated)
+            except Exception as e:
+                log.debug(f'[CACHE] Erro ao persistir lote: {e}')
+            self._bloom_add([key for key, _ in pairs])
+
+    def _bloom_add(self, keys):
+        """
+        Registra chaves ja persistidas no filtro ativo e no que esta sendo
+        montado. Depois do commit: se a montagem comecar depois deste ponto,
+        o SELECT dela ja ve a linha; se ja tiver comecado, a chave entra aqui.
+        """
+        for bloom in (self._bloom, self._bloom_building):
+            if bloom is not None:
+                for key in keys:
+                    bloom.add(key)
 
     def _put_l1(self, key: str, value: str):
-        """Insere no L1 com eviction LRU."""
-        with self._lock:
-            if key in self._l1:
-                self._l1.move_to_end(key)
-            else:
-                if len(self._l1) >= self._max_memory:
-                    self._l1.popitem(last=False)
-                self._l1[key] = value
+        """Insere no L1 com eviction LRU (por fatia)."""
+        shard = self._shard(key)
+        with shard.lock:
+            if key in shard.lru:
+                shard.lru.move_to_end(key)
+            elif len(shard.lru) >= shard.max_size:
+                shard.lru.popitem(last=False)
+            shard.lru[key] = value
 
     def get_stats(self) -> dict:
         """Retorna metricas do cache."""
-        total = self.total_lookups or 1
+        # Soma sem lock: leitura de int e atomica; metricas aproximadas bastam
+        lookups = sum(sh.lookups for sh in self._shards)
+        hits_l1 = sum(sh.hits_l1 for sh in self._shards)
+        hits_l2 = sum(sh.hits_l2 for sh in self._shards)
+        total = lookups or 1
         return {
-            'total_lookups': self.total_lookups,
-            'hits_l1': self.hits_l1,
-            'hits_l2': self.hits_l2,
-            'misses': self.misses,
-            'hit_rate_l1': f'{(self.hits_l1 / total) * 100:.1f}%',
-            'hit_rate_total': f'{((self.hits_l1 + self.hits_l2) / total) * 100:.1f}%',
-            'l1_size': len(self._l1),
+            'total_lookups': lookups,
+            'hits_l1': hits_l1,
+            'hits_l2': hits_l2,
+            'misses': sum(sh.misses for sh in self._shards),
+            'hit_rate_l1': f'{(hits_l1 / total) * 100:.1f}%',
+            'hit_rate_total': f'{((hits_l1 + hits_l2) / total) * 100:.1f}%',
+            'l1_size': sum(len(sh.lru) for sh in self._shards),
             'l1_max': self._max_memory,
         }
 
     def warm_up(self, limit: int = 5000):
         """Pre-carrega as traducoes mais usadas do SQLite para L1."""
         try:
-            from backend.auth import _db_conn, _db_lock
-            with _db_lock:
-                with _db_conn() as conn:
-                    rows = conn.execute(
-                        "SELECT source_text, translated_text FROM translation_cache "
-                        "ORDER BY hit_count DESC LIMIT ?",
-                        (limit,),
-                    ).fetchall()
-                    for row in rows:
-                        self._put_l1(row['source_text'], row['translated_text'])
-                    log.info(f'[CACHE] Warm-up: {len(rows)} traducoes carregadas em memoria')
+            from backend.auth import _read_conn
+            with _read_conn() as conn:
+                rows = conn.execute(
+                    "SELECT source_text, translated_text FROM translation_cache "
+                    "ORDER BY hit_count DESC LIMIT ?",
+                    (limit,),
+                ).fetchall()
+            for row in rows:
+                self._put_l1(row['source_text'], row['translated_text'])
+            log.info(f'[CACHE] Warm-up: {len(rows)} traducoes carregadas em memoria')
         except Exception as e:
             log.warning(f'[CACHE] Erro no warm-up: {e}')
+
+        if self._bloom_capacity > 0:
+            # Varredura de ate CACHE_MAX_ROWS chaves fora do get_engine()
+            threading.Thread(
+                target=self.rebuild_bloom, daemon=True, name='cache-bloom',
+            ).start()
+
+    def rebuild_bloom(self):
+        """
+        (Re)monta o filtro de Bloom com todas as chaves do SQLite (so as
+        chaves) e troca pelo atual ao final. Chamado em background no warm_up
+        e pela manutencao do banco apos a evicao LRU, que removeria linhas
+        ainda marcadas no filtro (falsos positivos acumulando).
+        """
+        if self._bloom_capacity <= 0:
+            return
+        if not self._bloom_build_lock.acquire(blocking=False):
+            return  # ja ha uma montagem em andamento
+        try:
+            from backend.auth import _read_conn
+            bloom = self._bloom_building = _BloomFilter(self._bloom_capacity)
+            count = 0
+            with _read_conn() as conn:
+                for (source_text,) in conn.execute("SELECT source_text FROM translation_cache"):
+                    bloom.add(source_text)
+                    count += 1
+            self._bloom = bloom
+            log.info(f'[CACHE] Filtro de Bloom: {count} chaves ({len(bloom._bits) / 1024:.0f} KB)')
+        except Exception as e:
+            log.warning(f'[CACHE] Erro ao montar filtro de Bloom: {e}')
+        finally:
+            self._bloom_building = None
+            self._bloom_build_lock.release()
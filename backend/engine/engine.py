@@ -1,5 +1,6 @@
 """TranslationEngine — orquestrador principal com fallback chain."""
 
+import logging
 import time
 from typing import List, Optional
 
@@ -30,13 +31,18 @@ class TranslationEngine:
         Traduz texto usando cache + fallback chain.
         Retorna texto traduzido, ou o original como ultimo recurso.
         """
-        if not text.strip():
+        # Chave canonica calculada uma vez (cache e comparacao com o resultado)
+        key = text.strip()
+        if not key:
             return text
 
         # 1. Verificar cache
-        cached, level = self.cache.get(text)
+        cached, level = self.cache.get(key)
         if cached:
             return cached
+        key_lower = key.lower()
+        # Mensagens DEBUG abaixo sao por texto: so monta-las com DEBUG ativo
+        debug = log.isEnabledFor(logging.DEBUG)
 
         # 2. Tentar cada provider na chain
         for provider in self.providers:
@@ -46,30 +52,34 @@ class TranslationEngine:
                 continue
 
             if status == ProviderStatus.RATE_LIMITED:
-                remaining = provider.stats.cooldown_until - time.time()
-                log.debug(
-                    f'[ENGINE] {provider.name} em cooldown '
-                    f'({remaining:.0f}s restantes)'
-                )
+                if debug:
+                    remaining = provider.stats.cooldown_until - time.time()
+                    log.debug(
+                        f'[ENGINE] {provider.name} em cooldown '
+                        f'({remaining:.0f}s restantes)'
+                    )
                 continue
 
             if not provider.check_rate_limit():
-                log.debug(
-                    f'[ENGINE] {provider.name} atingiu RPM limit, '
-                    f'tentando proximo'
-                )
+                if debug:
+                    log.debug(
+                        f'[ENGINE] {provider.name} atingiu RPM limit, '
+                        f'tentando proximo'
+                    )
                 continue
 
-            log.debug(f'[ENGINE] Tentando {provider.name} para: {text[:50]}...')
+            if debug:
+                log.debug(f'[ENGINE] Tentando {provider.name} para: {text[:50]}...')
             result = provider.translate(text)
 
-            if result and result.strip().lower() != text.strip().lower():
-                self.cache.put(text, result, persist=True)
+            if result and result.strip().lower() != key_lower:
+                self.cache.put(key, result, persist=True)
                 return result
 
-            log.debug(
-                f'[ENGINE] {provider.name} falhou, tentando proximo provider'
-            )
+            if debug:
+                log.debug(
+                    f'[ENGINE] {provider.name} falhou, tentando proximo provider'
+                )
 
         # 3. Nenhum provider conseguiu
         log.warning(f'[ENGINE] TODOS providers falharam para: {text[:60]}...')
@@ -85,14 +95,15 @@ class TranslationEngine:
             return []
 
         results = [None] * len(texts)
+        keys = [text.strip() for text in texts]  # chaves canonicas do cache
 
         # 1. Verificar cache para cada texto
         uncached_indices = []
         for i, text in enumerate(texts):
-            if not text.strip():
+            if not keys[i]:
                 results[i] = text
                 continue
-            cached, level = self.cache.get(text)
+            cached, level = self.cache.get(keys[i])
             if cached:
                 results[i] = cached
             else:
@@ -143,18 +154,21 @@ class TranslationEngine:
 
             # Processar resultados do batch
             still_pending = []
+            to_cache = []
             for k, batch_idx in enumerate(pending_indices):
                 original_idx = uncached_indices[batch_idx]
-                original_text = texts[original_idx]
+                key = keys[original_idx]
 
                 translated = batch_results[k] if k < len(batch_results) else None
 
-                if translated and translated.strip().lower() != original_text.strip().lower():
+                if translated and translated.strip().lower() != key.lower():
                     results[original_idx] = translated
-                    self.cache.put(original_text, translated, persist=True)
+                    to_cache.append((key, translated))
                 else:
                     still_pending.append(batch_idx)
 
+            # Uma transacao SQLite por batch em vez de uma por texto
+            self.cache.put_many(to_cache, persist=True)
             pending_indices = still_pending
 
             if pending_indices:
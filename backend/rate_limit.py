@@ -0,0 +1,162 @@
+"""
+Rate limiting por token bucket (GCRA).
+
+Cada chave guarda um unico numero, o TAT ("theoretical arrival time"): o
+instante em que o bucket estaria cheio de novo. Cada hit avanca o TAT em
+window/limit; o hit e negado se isso o levaria alem de agora + window.
+Equivale a um bucket de capacidade `limit` que recarrega `limit` tokens por
+`window` segundos, sem lista de timestamps para varrer.
+
+Backend Redis (script Lua atomico: um round-trip por checagem) quando
+REDIS_URL esta definido e o pacote redis esta instalado; senao, fallback em
+memoria do processo (suficiente com --workers 1).
+"""
+
+import math
+import threading
+import time
+
+from backend.config import REDIS_URL, log
+
+try:
+    # Opcional: limites compartilhados entre processos/replicas
+    import redis
+except ImportError:
+    redis = None
+
+
+# Modos de _gcra
+_ALLOW = 'allow'    # checa e consome se couber
+_CHECK = 'check'    # so checa
+_RECORD = 'record'  # consome sem checar
+
+# _gcra devolve a espera (segundos) ate o proximo hit caber: 0 = cabe agora
+
+
+# ============================================================================
+# Backend Redis
+# ============================================================================
+
+# KEYS[1]=chave  ARGV: agora_ms, intervalo_ms, janela_ms, modo
+# Retorna a espera em ms ate o hit caber (0 = cabe)
+_GCRA_LUA = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local window = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1]) or 0)
+if tat < now then tat = now end
+local wait = math.max(0, tat + interval - now - window)
+if ARGV[4] == 'check' or (ARGV[4] == 'allow' and wait > 0) then
+    return wait
+end
+local new = math.min(tat + interval, now + window)
+redis.call('SET', KEYS[1], new, 'PX', new - now)
+return wait
+"""
+
+_redis = None
+_gcra_script = None
+
+if REDIS_URL and redis is not None:
+    try:
+        _redis = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+        _redis.ping()
+        _gcra_script = _redis.register_script(_GCRA_LUA)
+        log.info('[RATE] Rate limit via Redis')
+    except Exception as e:
+        log.warning(f'[RATE] Redis indisponivel ({e}), usando rate limit em memoria')
+        _redis = None
+elif REDIS_URL:
+    log.warning('[RATE] REDIS_URL definido mas pacote redis nao instalado, usando memoria')
+
+
+def get_redis():
+    """Cliente Redis compartilhado (OTP etc.), ou None se nao configurado/indisponivel."""
+    return _redis
+
+
+def _now_ms() -> int:
+    # Relogio de parede: precisa ser comparavel entre processos/maquinas
+    return int(time.time() * 1000)
+
+
+# ============================================================================
+# Fallback em memoria
+# ============================================================================
+
+# {chave: tat_ns} — chave com tat <= agora esta com o bucket cheio
+_tat = {}
+_tat_lock = threading.Lock()
+_PRUNE_EVERY = 256  # poda lazy de buckets cheios a cada N escritas
+_writes = 0
+
+
+def _gcra_local(key: str, limit: int, window: float, mode: str) -> float:
+    global _writes
+    now = time.monotonic_ns()
+    window_ns = int(window * 1_000_000_000)
+    interval = window_ns // limit
+    with _tat_lock:
+        tat = max(_tat.get(key, 0), now)
+        wait = max(0, tat + interval - now - window_ns) / 1_000_000_000
+        if mode == _CHECK or (mode == _ALLOW and wait > 0):
+            return wait
+        _tat[key] = min(tat + interval, now + window_ns)
+        _writes += 1
+        if _writes % _PRUNE_EVERY == 0:
+            # Bucket cheio equivale a chave ausente: sem limpeza ativa
+            for k, k_tat in list(_tat.items()):
+                if k_tat <= now:
+                    del _tat[k]
+    return wait
+
+
+def _gcra(key: str, limit: int, window: float, mode: str) -> float:
+    if _redis is not None:
+        try:
+            window_ms = int(window * 1000)
+            return int(_gcra_script(
+                keys=[key],
+                args=[_now_ms(), max(1, math.ceil(window_ms / limit)), window_ms, mode],
+            )) / 1000
+        except Exception as e:
+            log.error(f'[RATE] Erro no Redis, usando memoria: {e}')
+    return _gcra_local(key, limit, window, mode)
+
+
+# ============================================================================
+# API
+# ============================================================================
+
+def allow(key: str, limit: int, window: float) -> bool:
+    """
+    Checa e consome atomicamente um token: True se a chave ainda estava
+    dentro de `limit` hits por `window` segundos.
+    """
+    return _gcra(key, limit, window, _ALLOW) == 0
+
+
+def retry_after(key: str, limit: int, window: float) -> int:
+    """
+    Segundos (arredondados para cima) ate o proximo hit ser aceito; 0 se ja
+    seria aceito agora. Nao consome token. Esgotado o bucket, volta a caber
+    um hit a cada window/limit segundos (nao a janela inteira).
+    """
+    return math.ceil(_gcra(key, limit, window, _CHECK))
+
+
+def record(key: str, limit: int, window: float) -> None:
+    """Consome um token sem checar limite (ex: tentativa de login falha)."""
+    _gcra(key, limit, window, _RECORD)
+
+
+def reset(key: str) -> None:
+    """Enche o bucket de uma chave (ex: login bem-sucedido)."""
+    if _redis is not None:
+        try:
+            _redis.delete(key)
+        except Exception as e:
+            log.error(f'[RATE] Erro no Redis: {e}')
+
+    with _tat_lock:
+        _tat.pop(key, None)
@@ -4,10 +4,13 @@ Importa funcoes do script existente e adiciona progresso via WebSocket.
 """
 
 import io
+import itertools
+import json
 import os
 import shutil
 import subprocess
 import tarfile
+import tempfile
 import time
 import zipfile
 import uuid
@@ -20,7 +23,12 @@ import backend.translate as trans_engine
 
 from backend.config import JOBS_FOLDER, DEFAULT_DELAY, log
 from backend.engine import get_engine
-from backend.auth import save_job_db, get_jobs_db, get_job_db, delete_job_db, update_storage_used
+from backend.auth import save_job_db, get_jobs_summary_db, get_job_db, delete_job_db, update_storage_used
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 BATCH_SIZE = 100
 MAX_PARALLEL_FILES = 4
@@ -33,10 +41,25 @@ _progress_lock = threading.Lock()
 # Model — Job de traducao
 # ============================================================================
 
+# Atributos expostos em to_dict(): atribuir qualquer um invalida o JSON em cache
+_JOB_STATE_FIELDS = frozenset((
+    'job_id', 'status', 'progress', 'current_file', 'total_files', 'files_done',
+    'total_strings', 'translated_strings', 'errors', 'created_at', 'started_at',
+    'finished_at', 'output_zip', 'output_tar', 'validation', 'user_email',
+    'file_size_bytes',
+))
+# Versoes unicas e monotonicas (next() e atomico sob o GIL, sem lock)
+_job_versions = itertools.count(1)
+
+
 class TranslationJob:
     """Representa um job de traducao com estado e progresso."""
 
     def __init__(self, job_id, input_dir, output_dir, delay=DEFAULT_DELAY, user_email=''):
+        # JSON de to_dict() em cache: (versao, bytes)
+        self._version = 0
+        self._json = None
+
         self.job_id = job_id
         self.input_dir = input_dir
         self.output_dir = output_dir
@@ -76,6 +99,7 @@ class TranslationJob:
             'total_strings': self.total_strings,
             'translated_strings': self.translated_strings,
             'errors': self.errors[-10:],
+            'error_count': len(self.errors),
             'created_at': self.created_at,
             'started_at': self.started_at,
             'finished_at': self.finished_at,
@@ -86,16 +110,107 @@ class TranslationJob:
             'file_size_bytes': self.file_size_bytes,
         }
 
+    def to_progress_dict(self):
+        """
+        Subconjunto de to_dict() para os frames periodicos de progresso: sem
+        errors, validation e metadados que so mudam em transicoes de estado
+        (essas continuam mandando to_dict() completo).
+        """
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'progress': self.progress,
+            'current_file': self.current_file,
+            'total_files': self.total_files,
+            'files_done': self.files_done,
+            'total_strings': self.total_strings,
+            'translated_strings': self.translated_strings,
+        }
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in _JOB_STATE_FIELDS:
+            object.__setattr__(self, '_version', next(_job_versions))
+
+    def add_error(self, message):
+        """Registra erro (append na lista nao passa pelo __setattr__)."""
+        self.errors.append(message)
+        self._version = next(_job_versions)
+
+    def to_json(self):
+        """
+        to_dict() serializado, reaproveitado ate a proxima mudanca de estado:
+        polling de varios clientes nao re-serializa o mesmo estado.
+        A versao e lida antes do to_dict(): se o job mudar no meio, o cache
+        fica com versao antiga e nunca e servido.
+        """
+        cached = self._json
+        version = self._version
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        data = self.to_dict()
+        body = orjson.dumps(data) if orjson else json.dumps(data).encode('utf-8')
+        self._json = (version, body)
+        return body
+
     def cancel(self):
         self._cancel_flag = True
 
 
+# ============================================================================
+# Progresso via WebSocket (coalescido)
+# ============================================================================
+
+_PROGRESS_INTERVAL = 0.08  # segundos
+
+
+class _ProgressDebouncer:
+    """
+    Agrupa emits de translation_progress: um unico loop em background troca o
+    dict de pendentes a cada _PROGRESS_INTERVAL e emite um frame por sala.
+    So o estado mais recente de cada job importa (to_progress_dict() feito no
+    flush), entao nao ha lista de snapshots intermediarios.
+    Mudancas de estado (inicio, erro, conclusao) continuam com emit direto.
+    """
+
+    def __init__(self, interval=_PROGRESS_INTERVAL):
+        self._interval = interval
+        self._pending = {}  # job_id -> job
+        self._lock = threading.Lock()
+        self._started = False
+
+    def emit(self, socketio, job):
+        with self._lock:
+            self._pending[job.job_id] = job
+            if self._started:
+                return
+            self._started = True
+        socketio.start_background_task(self._flush_loop, socketio)
+
+    def _flush_loop(self, socketio):
+        while True:
+            socketio.sleep(self._interval)
+            with self._lock:
+                if not self._pending:
+                    continue
+                pending, self._pending = self._pending, {}
+            for job_id, job in pending.items():
+                try:
+                    socketio.emit('translation_progress', job.to_progress_dict(), room=job_id)
+                except Exception as e:
+                    log.error(f'[WS] Erro ao emitir progresso de {job_id}: {e}')
+
+
+_progress = _ProgressDebouncer()
+
+
 # ============================================================================
 # Registro global de jobs (em memoria)
 # ============================================================================
 
 _jobs = {}
 _jobs_lock = threading.Lock()
+_running_jobs = 0  # jobs com thread de traducao ativa (ver _run)
 
 
 def _get(job_id):
@@ -114,9 +229,8 @@ def _pop(job_id):
 
 
 def count_running_jobs():
-    """Conta quantos jobs estao em execucao."""
-    with _jobs_lock:
-        return sum(1 for j in _jobs.values() if j.status == 'running')
+    """Conta quantos jobs estao em execucao (leitura O(1), sem varrer _jobs)."""
+    return _running_jobs
 
 
 # ============================================================================
@@ -126,37 +240,126 @@ def count_running_jobs():
 ALLOWED_EXTENSIONS = ('.zip', '.rar', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2')
 
 
+# Descompressores paralelos opcionais (usados se estiverem no PATH)
+_TAR_DECOMPRESSORS = {
+    ('.tar.gz', '.tgz'): 'pigz',
+    ('.tar.bz2', '.tbz2'): 'pbzip2',
+}
+
+# Extracao de ZIP em paralelo so compensa a partir de alguns membros
+_ZIP_PARALLEL_MIN_MEMBERS = 32
+_ZIP_WORKERS = os.cpu_count() or 1
+
+
 def _safe_zip_extract(zf, extract_to):
     """Extrai ZIP validando cada membro contra path traversal (ZIP Slip)."""
     target = os.path.realpath(extract_to)
-    for member in zf.namelist():
-        member_path = os.path.realpath(os.path.join(target, member))
+    members = zf.infolist()
+    for member in members:
+        member_path = os.path.realpath(os.path.join(target, member.filename))
         if not member_path.startswith(target + os.sep) and member_path != target:
-            raise ValueError(f"Path traversal detectado: {member}")
-    zf.extractall(extract_to)
+            raise ValueError(f"Path traversal detectado: {member.filename}")
+
+    if len(members) < _ZIP_PARALLEL_MIN_MEMBERS or _ZIP_WORKERS < 2:
+        zf.extractall(extract_to)
+        return
+
+    # Diretorios criados antes (serial) para as threads nao disputarem makedirs;
+    # zlib libera o GIL, entao a descompressao dos membros roda em paralelo
+    for member in members:
+        name = member.filename if member.is_dir() else os.path.dirname(member.filename)
+        if name:
+            os.makedirs(os.path.join(extract_to, name), exist_ok=True)
+    files = [m for m in members if not m.is_dir()]
+    with ThreadPoolExecutor(max_workers=_ZIP_WORKERS) as pool:
+        for _ in pool.map(lambda m: zf.extract(m, extract_to), files):
+            pass
 
 
-def _extract_archive(archive_path, extract_to):
-    """Extrai ZIP, RAR ou TAR e retorna o diretorio com arquivos .php."""
-    lower = archive_path.lower()
-    basename = os.path.basename(archive_path)
+def _extract_rar(archive_path, extract_to):
+    subprocess.run(
+        ['unrar', 'x', '-o+', archive_path, extract_to],
+        check=True, capture_output=True,
+    )
+
+
+def _extract_tar(archive, extract_to, lower):
+    """
+    Extrai TAR com o filtro 'data' do tarfile. Para .tar.gz/.tar.bz2, se
+    pigz/pbzip2 estiver instalado, a descompressao roda em outro processo
+    (multi-core) e o tarfile so le o stream ja descomprimido.
+    `archive` e um caminho ou um arquivo binario aberto (com fileno).
+    """
+    is_path = isinstance(archive, str)
+    try:
+        piped = is_path or archive.fileno() >= 0
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        piped = False  # ex: BytesIO, sem fd para o subprocesso
+    for exts, program in _TAR_DECOMPRESSORS.items():
+        if piped and lower.endswith(exts) and shutil.which(program):
+            if is_path:
+                cmd, stdin = [program, '-dc', archive], None
+            else:
+                # Descompressor le direto do fd do upload
+                archive.seek(0)
+                cmd, stdin = [program, '-dc'], archive
+            proc = subprocess.Popen(
+                cmd, stdin=stdin,
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            )
+            try:
+                with tarfile.open(fileobj=proc.stdout, mode='r|') as tf:
+                    tf.extractall(extract_to, filter='data')
+            finally:
+                proc.stdout.close()
+                returncode = proc.wait()
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, program)
+            return
+
+    if is_path:
+        tf = tarfile.open(archive, 'r:*')
+    else:
+        archive.seek(0)
+        tf = tarfile.open(fileobj=archive, mode='r:*')
+    with tf:
+        tf.extractall(extract_to, filter='data')
+
+
+def _extract_archive(archive, extract_to, archive_name=None):
+    """
+    Extrai ZIP, RAR ou TAR e retorna o diretorio com arquivos .php.
+    `archive` e um caminho ou um arquivo binario aberto e seekable (ex: o
+    TemporaryFile do upload); nesse caso o formato vem de `archive_name`.
+    """
+    is_path = isinstance(archive, str)
+    basename = os.path.basename(archive if is_path else archive_name or '')
+    lower = basename.lower()
 
     if lower.endswith('.zip'):
         log.info(f'Extraindo ZIP: {basename}')
-        with zipfile.ZipFile(archive_path, 'r') as zf:
+        if not is_path:
+            archive.seek(0)
+        with zipfile.ZipFile(archive, 'r') as zf:
             _safe_zip_extract(zf, extract_to)
 
     elif lower.endswith('.rar'):
         log.info(f'Extraindo RAR: {basename}')
-        subprocess.run(
-            ['unrar', 'x', '-o+', archive_path, extract_to],
-            check=True, capture_output=True,
-        )
+        if is_path:
+            _extract_rar(archive, extract_to)
+        else:
+            # unrar so aceita caminho: unica copia para disco nesse formato
+            archive.seek(0)
+            with tempfile.NamedTemporaryFile(
+                suffix='.rar', dir=os.path.dirname(extract_to),
+            ) as tmp:
+                shutil.copyfileobj(archive, tmp, 1 << 20)
+                tmp.flush()
+                _extract_rar(tmp.name, extract_to)
 
     elif lower.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2')):
         log.info(f'Extraindo TAR: {basename}')
-        with tarfile.open(archive_path, 'r:*') as tf:
-            tf.extractall(extract_to, filter='data')
+        _extract_tar(archive, extract_to, lower)
 
     else:
         raise ValueError(f"Formato nao suportado: {basename}")
@@ -260,7 +463,7 @@ def _translate_file(src_path, dst_path, delay, job, socketio=None):
     except Exception as e:
         log.error(f'[{job.job_id}] Erro ao ler {rel}: {e}')
         with _progress_lock:
-            job.errors.append(f"Erro leitura: {rel}: {e}")
+            job.add_error(f"Erro leitura: {rel}: {e}")
         return 0
 
     total_lines = len(src_lines)
@@ -329,14 +532,14 @@ def _translate_file(src_path, dst_path, delay, job, socketio=None):
             if socketio and job.total_strings > 0:
                 with _progress_lock:
                     job.progress = int((job.translated_strings / job.total_strings) * 100)
-                socketio.emit('translation_progress', job.to_dict(), room=job.job_id)
+                _progress.emit(socketio, job)
 
             time.sleep(delay)
 
     except Exception as e:
         log.error(f'[{job.job_id}] Erro em {rel} batch: {e}')
         with _progress_lock:
-            job.errors.append(f"Erro: {rel}: {e}")
+            job.add_error(f"Erro: {rel}: {e}")
 
     # --- Pass 3: escrever arquivo ---
     try:
@@ -347,7 +550,7 @@ def _translate_file(src_path, dst_path, delay, job, socketio=None):
     except Exception as e:
         log.error(f'[{job.job_id}] Erro ao escrever {rel}: {e}')
         with _progress_lock:
-            job.errors.append(f"Erro escrita: {rel}: {e}")
+            job.add_error(f"Erro escrita: {rel}: {e}")
 
     log.info(f'[{job.job_id}] {rel}: {count} strings traduzidas (batch)')
     return count
@@ -358,7 +561,19 @@ def _translate_file(src_path, dst_path, delay, job, socketio=None):
 # ============================================================================
 
 def _run(job, socketio):
-    """Thread principal de traducao."""
+    """Thread principal de traducao: mantem o contador de jobs em execucao."""
+    global _running_jobs
+    with _jobs_lock:
+        _running_jobs += 1
+    try:
+        _run_job(job, socketio)
+    finally:
+        with _jobs_lock:
+            _running_jobs -= 1
+
+
+def _run_job(job, socketio):
+    """Executa a traducao do job (extracao ja feita)."""
     log.info(f'[{job.job_id}] Iniciando traducao (delay={job.delay}s)')
     job.status = 'running'
     job.started_at = datetime.now().isoformat()
@@ -387,7 +602,7 @@ def _run(job, socketio):
 
         if not tasks:
             log.error(f'[{job.job_id}] Nenhum arquivo PHP encontrado')
-            job.errors.append("Nenhum arquivo PHP encontrado no arquivo enviado")
+            job.add_error("Nenhum arquivo PHP encontrado no arquivo enviado")
             job.status = 'failed'
             job.finished_at = datetime.now().isoformat()
             save_job_db(job.to_dict())
@@ -411,14 +626,14 @@ def _run(job, socketio):
                 except Exception as e:
                     log.error(f'[{job.job_id}] Erro thread {rel}: {e}')
                     with _progress_lock:
-                        job.errors.append(f"Erro thread: {rel}: {e}")
+                        job.add_error(f"Erro thread: {rel}: {e}")
 
                 with _progress_lock:
                     job.files_done += 1
                     job.current_file = rel
                     if job.total_strings > 0:
                         job.progress = int((job.translated_strings / job.total_strings) * 100)
-                socketio.emit('translation_progress', job.to_dict(), room=job.job_id)
+                _progress.emit(socketio, job)
 
                 if job._cancel_flag:
                     cancelled = True
@@ -497,7 +712,7 @@ def _run(job, socketio):
     except Exception as e:
         job.status = 'failed'
         job.finished_at = datetime.now().isoformat()
-        job.errors.append(f"Erro fatal: {str(e)}")
+        job.add_error(f"Erro fatal: {str(e)}")
         log.error(f'[{job.job_id}] FALHA FATAL: {e}', exc_info=True)
         save_job_db(job.to_dict())
         socketio.emit('translation_error', job.to_dict(), room=job.job_id)
@@ -514,8 +729,11 @@ def _run(job, socketio):
 # API publica do servico
 # ============================================================================
 
-def start_translation(archive_path, delay, socketio, user_email=''):
-    """Inicia novo job a partir de arquivo compactado. Retorna job_id."""
+def start_translation(archive, delay, socketio, user_email='', archive_name=None):
+    """
+    Inicia novo job a partir de arquivo compactado (caminho ou arquivo aberto,
+    ver _extract_archive). Retorna job_id.
+    """
     job_id = str(uuid.uuid4())[:8]
     job_dir = os.path.join(JOBS_FOLDER, job_id)
     input_dir = os.path.join(job_dir, 'input')
@@ -525,7 +743,7 @@ def start_translation(archive_path, delay, socketio, user_email=''):
     os.makedirs(output_dir, exist_ok=True)
 
     log.info(f'[{job_id}] Extraindo arquivo...')
-    php_dir = _extract_archive(archive_path, input_dir)
+    php_dir = _extract_archive(archive, input_dir, archive_name)
 
     job = TranslationJob(job_id, php_dir, output_dir, delay, user_email)
     _put(job)
@@ -665,7 +883,7 @@ def list_jobs(user_email=None):
 
     # DB primeiro (historico)
     if user_email:
-        for jd in get_jobs_db(user_email):
+        for jd in get_jobs_summary_db(user_email):
             merged[jd['job_id']] = jd
 
     # Memoria sobrescreve (dados em tempo real)
@@ -195,7 +195,7 @@ dpkg --configure -a 2>/dev/null || true
 # Pacotes base (idempotente — apt pula se ja instalado)
 apt-get install -y \
     python3 python3-venv python3-pip \
-    nginx rsync curl \
+    nginx rsync curl pigz pbzip2 \
     certbot python3-certbot-nginx \
     2>&1 | grep -E "^(Err|W:|E:|Setting up|Installing)" | sed 's/^/  /' || true
 
@@ -409,6 +409,7 @@ Type=simple
 User=$DEPLOY_USER
 WorkingDirectory=$INSTALL_DIR
 Environment=PATH=$VENV_DIR/bin:/usr/local/bin:/usr/bin:/bin
+Environment=X_ACCEL_REDIRECT=1
 EnvironmentFile=$ENV_FILE
 ExecStart=$VENV_DIR/bin/gunicorn \\
     --worker-class geventwebsocket.gunicorn.workers.GeventWebSocketWorker \\
@@ -37,6 +37,8 @@ export default function App() {
           setCurrentJobId(active.job_id)
           setJobData(active)
           joinJob(active.job_id)
+          // Listagem so traz o resumo: buscar errors/validation do job restaurado
+          getJobStatus(active.job_id).then(setJobData).catch(() => {})
         }
       })
       .catch(() => {})
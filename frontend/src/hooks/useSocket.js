@@ -24,7 +24,11 @@ export function useSocket() {
 
     socket.on('disconnect', () => setConnected(false))
 
-    socket.on('translation_progress', setJobData)
+    // Frames de progresso trazem so os contadores: mesclar sobre o ultimo
+    // estado completo do mesmo job (errors, validation, has_output...)
+    socket.on('translation_progress', (data) => {
+      setJobData((prev) => (prev?.job_id === data.job_id ? { ...prev, ...data } : data))
+    })
     socket.on('translation_complete', setJobData)
     socket.on('translation_error', setJobData)
 
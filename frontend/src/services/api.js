@@ -70,14 +70,14 @@ export async function getMe() {
 // ─── Jobs ─────────────────────────────────────────────────────────────────────
 
 export async function uploadZip(file, delay = 0.2) {
-  const formData = new FormData()
-  formData.append('file', file)
-  formData.append('delay', delay.toString())
+  // Corpo bruto (sem multipart): o backend grava direto em disco em streaming
+  const params = new URLSearchParams({ filename: file.name, delay: delay.toString() })
 
-  const res = await fetch(`${API_BASE}/upload`, {
+  const res = await fetch(`${API_BASE}/upload?${params}`, {
     method: 'POST',
     credentials: 'include',
-    body: formData,
+    headers: { 'Content-Type': 'application/octet-stream' },
+    body: file,
   })
 
   if (!res.ok) {